@@ -1,195 +1,1551 @@
 import asyncio
+import bisect
+import contextvars
+import csv
+import hashlib
+import importlib
+import io
 import json
-import math
 import os
+import pickle
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from difflib import get_close_matches
-from functools import partial
+from difflib import SequenceMatcher
+from functools import partial, wraps
+from typing import Literal
+from uuid import uuid4
 
+import aiohttp
 import discord
 import gspread
-import pandas as pd
+import requests
 from dotenv import load_dotenv
+from aiohttp import web
 from discord import app_commands
 from discord.ui import Button, View
-from googleapiclient.discovery import build
-from oauth2client.service_account import ServiceAccountCredentials
+from google.oauth2.service_account import Credentials
+from googleapiclient.errors import HttpError
+
+import charts
+
+class Metrics:
+    """Counters and latency histograms for commands, Google and Discord requests.
+
+    prometheus() renders everything for the /metrics endpoint, summary() gives the recent
+    p50/p99 of each timed series for /botstats.
+    """
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, recent=1000):
+        self.lock = threading.Lock()
+        self.counters = Counter()  # (name, labels) -> count
+        self.histograms = {}  # (name, labels) -> count per bucket, then the sum and the count
+        self.recent = {}  # (name, labels) -> the latest samples, for percentiles
+        self.errors = Counter()
+        self.gauges = {}  # name -> (label name, function giving a number or {label value: number})
+        self.recentSize = recent
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            self.counters[self.key(name, labels)] += amount
+
+    def observe(self, name, seconds, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = [0] * (len(self.buckets) + 2)
+                self.recent[key] = deque(maxlen=self.recentSize)
+            histogram = self.histograms[key]
+            histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            self.recent[key].append(seconds)
+
+    def record(self, name, seconds, status, **labels):
+        """Time and count one call, and count it for the guild it was made for."""
+        self.observe(name, seconds, **labels)
+        self.inc(name, status=status, **labels)
+        if status != 'ok':
+            with self.lock:
+                self.errors[self.key(name, labels)] += 1
+        guildID = current_guild.get()
+        if guildID is not None:
+            self.inc(f'guild_{name}', guild=guildID)
+
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            yield
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, status, **labels)
+
+    def gauge(self, name, read, label=None):
+        self.gauges[name] = (label, read)
+
+    def guild_counts(self, guildID):
+        with self.lock:
+            return {name[len('guild_'):]: count for (name, labels), count in self.counters.items()
+                    if name.startswith('guild_') and labels == (('guild', str(guildID)),)}
+
+    def summary(self):
+        """A row per timed series: its name and labels, calls, errors and recent p50, p99 and max in ms."""
+        rows = []
+        with self.lock:
+            for (name, labels), samples in sorted(self.recent.items()):
+                ordered = sorted(samples)
+                rows.append([' '.join([name] + [value for label, value in labels]), self.histograms[(name, labels)][-1],
+                             self.errors[(name, labels)], round(ordered[len(ordered) // 2] * 1000),
+                             round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000), round(ordered[-1] * 1000)])
+        return rows
+
+    def prometheus(self):
+        """Everything in the Prometheus text format."""
+        def labelled(name, labels, extra=()):
+            pairs = ','.join(f'{label}="{escape(value)}"' for label, value in labels + extra)
+            return f'podstats_{name}{{{pairs}}}' if pairs else f'podstats_{name}'
+
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(histogram)) for key, histogram in self.histograms.items())
+        for name in sorted({name for (name, labels), count in counters}):
+            lines.append(f'# TYPE podstats_{name}_total counter')
+            lines.extend(f'{labelled(f"{name}_total", labels)} {count}' for (counter, labels), count in counters if counter == name)
+        for name in sorted({name for (name, labels), histogram in histograms}):
+            lines.append(f'# TYPE podstats_{name}_seconds histogram')
+            for (series, labels), histogram in histograms:
+                if series != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), histogram):
+                    cumulative += count
+                    lines.append(f'{labelled(f"{name}_seconds_bucket", labels, (("le", bound),))} {cumulative}')
+                lines.append(f'{labelled(f"{name}_seconds_sum", labels)} {histogram[-2]}')
+                lines.append(f'{labelled(f"{name}_seconds_count", labels)} {histogram[-1]}')
+        for name, (label, read) in sorted(self.gauges.items()):
+            lines.append(f'# TYPE podstats_{name} gauge')
+            values = read()
+            if label is None:
+                lines.append(f'podstats_{name} {values}')
+            else:
+                lines.extend(f'{labelled(name, ((label, value),))} {number}' for value, number in sorted(values.items()))
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+# the guild whichever command, button or sync is running for, so its requests count for that guild
+current_guild = contextvars.ContextVar('current_guild', default=None)
+
+def endpoint_name(method, url):
+    """A request's method and path with the IDs, tokens and ranges swapped for placeholders."""
+    segments = []
+    for segment in url.split('?')[0].split('://')[-1].split('/')[1:]:
+        name, colon, action = segment.partition(':')
+        if segments and segments[-1] == 'values':
+            name = '{range}'
+        elif name.isdigit() or len(name) >= 20:
+            name = '{id}'
+        segments.append(name + colon + action)
+    return f'{method.upper()} /' + '/'.join(segments)
+
+# POSTs that can be sent twice without doing the work twice, everything else that POSTs (appends, copies) cannot
+idempotent_posts = (':batchGet', ':batchGetByDataFilter', ':batchUpdate', ':batchClear', ':clear')
+
+def idempotent_request(method, url):
+    """Whether a request can be sent again after an error without knowing if the first one landed."""
+    if method.upper() != 'POST':
+        return True
+    path = url.split('?')[0]
+    return '/values' in path and path.endswith(idempotent_posts)
+
+async def discord_request_start(session, context, params):
+    context.start = time.perf_counter()
+
+async def discord_request_end(session, context, params):
+    status = 'ok' if params.response.status < 400 else str(params.response.status)
+    metrics.record('discord_request', time.perf_counter() - context.start, status, endpoint=endpoint_name(params.method, str(params.url)))
+
+async def discord_request_failed(session, context, params):
+    metrics.record('discord_request', time.perf_counter() - context.start, 'error', endpoint=endpoint_name(params.method, str(params.url)))
+
+# every discord request, interaction responses and followups included, goes through this trace
+discord_trace = aiohttp.TraceConfig()
+discord_trace.on_request_start.append(discord_request_start)
+discord_trace.on_request_end.append(discord_request_end)
+discord_trace.on_request_exception.append(discord_request_failed)
+
+def timed(name):
+    """Time a command or button callback, with its requests counted for the guild it ran in."""
+    def decorate(callback):
+        @wraps(callback)
+        async def run(*args, **kwargs):
+            interaction = next(arg for arg in args if hasattr(arg, 'response'))
+            token = current_guild.set(interaction.guild.id if interaction.guild else None)
+            try:
+                with metrics.span('command', command=name):
+                    return await callback(*args, **kwargs)
+            finally:
+                current_guild.reset(token)
+        return run
+    return decorate
+
+async def watch_event_loop(interval=0.25):
+    """Keep measuring how late the event loop wakes up, which is how long something blocked it."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        metrics.observe('event_loop_lag', max(0.0, time.perf_counter() - start - interval))
+
+async def serve_metrics(host, port):
+    async def handle(request):
+        return web.Response(text=metrics.prometheus(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f'serving metrics on http://{host}:{port}/metrics')
 
 # Discord set up
 load_dotenv()
 discord_key = os.getenv('DiscordToken')
-intents = discord.Intents.all()
-bot = discord.Client(intents=intents)
+# only what the bot uses: guild events, and messages for /addplayers and /addcommanders to wait for
+intents = discord.Intents.none()
+intents.guilds = True
+intents.guild_messages = True
+intents.message_content = True
+
+# ShardCount shards the bot ('auto' asks discord how many), ShardIDs picks the ones this process runs and
+# ShardProcesses starts that many processes, each running every ShardProcesses-th shard
+shard_count = os.getenv('ShardCount')
+shard_ids = [int(shard) for shard in os.getenv('ShardIDs').split(',')] if os.getenv('ShardIDs') else None
+shard_processes = int(os.getenv('ShardProcesses', 1))
+if shard_ids is not None and not (shard_count or '').isdigit():
+    # which guilds belong to this process is worked out from the shard count, so it has to be known up front
+    raise SystemExit('ShardIDs needs ShardCount set to a number, not left out or auto')
+if shard_count is None:
+    bot = discord.Client(intents=intents, http_trace=discord_trace)
+else:
+    shard_count = None if shard_count == 'auto' else int(shard_count)
+    bot = discord.AutoShardedClient(intents=intents, http_trace=discord_trace, shard_count=shard_count, shard_ids=shard_ids)
 tree = app_commands.CommandTree(bot)
 
-# Google set up
-scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-creds = ServiceAccountCredentials.from_json_keyfile_name('PodStatsAuth.json', scope)
-client = gspread.authorize(creds)
-drive_service = build('drive', 'v3', credentials=creds)
-sheets_service = build('sheets', 'v4', credentials=creds)
+def owns_guild(guildID):
+    """Whether this process runs the shard discord sends the guild's events to."""
+    return shard_ids is None or (int(guildID) >> 22) % shard_count in shard_ids
+
+def owned_guilds_sql(column):
+    """A SQL condition on a guild ID column keeping the guilds this process runs, and its parameters."""
+    if shard_ids is None:
+        return '1', []
+    return f'({column} >> 22) % ? IN ({", ".join("?" * len(shard_ids))})', [shard_count, *shard_ids]
+
+def gateway_shard_count():
+    """How many shards discord recommends for the bot."""
+    response = requests.get('https://discord.com/api/v10/gateway/bot', headers={'Authorization': f'Bot {discord_key}'}, timeout=30)
+    response.raise_for_status()
+    return response.json()['shards']
+
+def launch_shards(processes):
+    """Run the shards in several processes sharing podstats.db, starting any that stop again."""
+    total = shard_count or gateway_shard_count()
+    processes = min(processes, total)
+    children = {}
+
+    def start(index):
+        env = dict(os.environ, ShardCount=str(total), ShardIDs=','.join(map(str, range(index, total, processes))))
+        # every process uses the same service account, so they split its quota instead of each taking all of it
+        for kind, (name, default) in google_quotas.items():
+            env[name] = str(max(1, google_scheduler.buckets[kind].capacity // processes))
+        if metrics_port:
+            env['MetricsPort'] = str(metrics_port + index)
+        children[index] = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+        print(f'started shard process {index} with shards {env["ShardIDs"]} of {total} . . .')
+
+    for index in range(processes):
+        start(index)
+    try:
+        while True:
+            time.sleep(5)
+            for index, child in list(children.items()):
+                if child.poll() is not None:
+                    print(f'shard process {index} stopped with code {child.returncode}, starting it again . . .')
+                    start(index)
+    except KeyboardInterrupt:
+        for child in children.values():
+            child.terminate()
+        for child in children.values():
+            child.wait()
+
+# the metrics endpoint is local only, MetricsPort=0 turns it off
+metrics_host = os.getenv('MetricsHost', '127.0.0.1')
+metrics_port = int(os.getenv('MetricsPort', 9108))
+metrics_tasks = []
+
+class TokenBucket:
+    """Hands out a per-minute quota evenly, letting a full minute's worth go out in a burst."""
+    def __init__(self, perMinute):
+        self.capacity = perMinute
+        self.tokens = perMinute
+        self.rate = perMinute / 60
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Take a token and return how long to wait before using it, 0 when one was free."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class GoogleScheduler:
+    """Every Sheets and Drive request waits here for a token, so the bot stays under Google's quotas.
+
+    Quota errors (429, Drive's rate limit 403s) and server errors are retried with
+    exponential backoff and full jitter. A request that is not idempotent, like an append,
+    is only retried on quota errors, since after a server error or timeout it may have
+    landed anyway, its caller decides what to do. Queue depth and wait times are kept for metrics().
+    """
+    def __init__(self, limits, maxRetries, maxBackoff):
+        self.buckets = {kind: TokenBucket(perMinute) for kind, perMinute in limits.items()}
+        self.maxRetries = maxRetries
+        self.maxBackoff = maxBackoff
+        self.lock = threading.Lock()
+        self.queued = 0  # run_sheets calls that have not reached a thread yet
+        self.waiting = 0  # requests sleeping until their token is due
+        self.counts = Counter()
+        self.waitSeconds = Counter()
+        self.longestWait = Counter()
+
+    def note(self, name, seconds=None):
+        with self.lock:
+            self.counts[name] += 1
+            if seconds is not None:
+                self.waitSeconds[name] += seconds
+                self.longestWait[name] = max(self.longestWait[name], seconds)
+
+    def enqueue(self):
+        with self.lock:
+            self.queued += 1
+        return time.monotonic()
+
+    def started(self, enqueued):
+        with self.lock:
+            self.queued -= 1
+        self.note('queue', time.monotonic() - enqueued)
+
+    def call(self, kind, send, endpoint=None, idempotent=True):
+        """Send a request once a token for its kind is free, retrying it while Google says to slow down."""
+        for attempt in range(self.maxRetries + 1):
+            wait = self.buckets[kind].take()
+            if wait:
+                with self.lock:
+                    self.waiting += 1
+                time.sleep(wait)
+                with self.lock:
+                    self.waiting -= 1
+                if wait > 1:
+                    print(f'waited {wait:.1f}s for {kind} quota ({self.waiting} waiting)')
+            self.note(kind, wait)
 
+            try:
+                with metrics.span('google_request', kind=kind, endpoint=endpoint or kind):
+                    return send()
+            except Exception as error:
+                if attempt == self.maxRetries or not self.retryable(error, idempotent):
+                    raise
+                delay = random.uniform(0, min(self.maxBackoff, 2 ** attempt))
+                self.note(f'{kind}_retry')
+                print(f'{kind} request failed ({error}), retrying in {delay:.1f}s . . .')
+                time.sleep(delay)
+
+    @staticmethod
+    def retryable(error, idempotent=True):
+        if isinstance(error, gspread.exceptions.APIError):
+            status, reasons = error.code, [e.get('reason') for e in error.error.get('errors', [])]
+        elif isinstance(error, HttpError):
+            status, reasons = error.resp.status, [e.get('reason') for e in error.error_details or [] if isinstance(e, dict)]
+        else:
+            return idempotent and isinstance(error, (requests.ConnectionError, requests.Timeout))
+        rateLimited = status == 403 and any(reason in ('rateLimitExceeded', 'userRateLimitExceeded') for reason in reasons)
+        # Google refuses a request over quota before doing anything, so only those are safe to send again
+        if not idempotent:
+            return status == 429 or rateLimited
+        return status in (408, 429) or status >= 500 or rateLimited
+
+    def metrics(self):
+        with self.lock:
+            return {'queued': self.queued, 'waiting': self.waiting, 'counts': dict(self.counts),
+                    'wait_seconds': dict(self.waitSeconds), 'longest_wait': dict(self.longestWait)}
+
+class ScheduledHTTPClient(gspread.http_client.HTTPClient):
+    """gspread's HTTP client with every request sent through the scheduler."""
+    def request(self, method, endpoint, *args, **kwargs):
+        if 'googleapis.com/drive' in endpoint:
+            kind = 'drive'
+        else:
+            kind = 'sheets_read' if method.lower() == 'get' else 'sheets_write'
+        return google_scheduler.call(kind, partial(super().request, method, endpoint, *args, **kwargs),
+                                     endpoint=endpoint_name(method, endpoint), idempotent=idempotent_request(method, endpoint))
+
+# Sheets allows 60 reads and 60 writes a minute per user, Drive a lot more but writes should stay slow
+google_quotas = {'sheets_read': ('SheetsReadsPerMinute', 60),
+                 'sheets_write': ('SheetsWritesPerMinute', 60),
+                 'drive': ('DriveRequestsPerMinute', 600)}
+google_scheduler = GoogleScheduler({kind: int(os.getenv(name, default)) for kind, (name, default) in google_quotas.items()},
+                                   maxRetries=int(os.getenv('GoogleMaxRetries', 6)),
+                                   maxBackoff=float(os.getenv('GoogleMaxBackoff', 64)))
+
+# Google set up, each client is built the first time something needs it so starting the bot stays quick
+scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+google_key_file = 'PodStatsAuth.json'
+google_clients = {}
+google_clients_lock = threading.RLock()
+
+def build_gspread():
+    gc = gspread.authorize(google_client('creds'), http_client=ScheduledHTTPClient)
+    gc.http_client.session.hooks['response'].append(count_api_call)
+    return gc
+
+def build_service(name, version):
+    from googleapiclient.discovery import build  # slow to import, and only needed once
+    # the discovery documents ship with google-api-python-client, so this never fetches one
+    return build(name, version, credentials=google_client('creds'), static_discovery=True, cache_discovery=False)
+
+google_builders = {'creds': lambda: Credentials.from_service_account_file(google_key_file, scopes=scope),
+                   'gspread': build_gspread,
+                   'drive': partial(build_service, 'drive', 'v3'),
+                   'sheets': partial(build_service, 'sheets', 'v4')}
+
+def google_client(name):
+    """The service account credentials, the gspread client or a discovery service ('drive', 'sheets'), built once."""
+    if name not in google_clients:
+        with google_clients_lock:
+            if name not in google_clients:
+                google_clients[name] = google_builders[name]()
+    return google_clients[name]
+
+# Google calls are blocking, so they run in this pool instead of on the event loop
+sheets_executor = ThreadPoolExecutor(max_workers=int(os.getenv('SheetsWorkers', 8)), thread_name_prefix='sheets')
+guild_locks = {}
+sheets_reads = {}
+
+# counts the Google round trips made by whichever sheets thread is running
+api_calls = threading.local()
+
+# opened spreadsheets by the IDs in active_sheets, trusted for SheetCacheTTL seconds
+sheet_cache = {}
+sheet_cache_ttl = int(os.getenv('SheetCacheTTL', 600))
 
 # Files to store information
 channels_file = 'channels.json'
 used_commands_file = 'used_commands.json'
 active_stats_file = 'active_stats.json'
-
-active_game = {
-}
-
-def load_channels():
-    if os.path.exists(channels_file):
-        with open(channels_file, 'r') as f:
-            return json.load(f)
-    return {}
-def save_channels(channels):
-    with open(channels_file, 'w') as f:
-        json.dump(channels, f, indent=4)
+database_file = 'podstats.db'
+
+# games added but not finished yet, by guild and then game ID, in the order they were added
+active_games = {}
+
+# seconds between journal flushes to the spreadsheets, and the longest a failing guild waits to retry
+journal_flush_seconds = float(os.getenv('JournalFlushSeconds', 2))
+journal_max_backoff = float(os.getenv('JournalMaxBackoff', 300))
+
+class ConfigStore:
+    """Each guild's bot channel and spreadsheet, in SQLite so a write only touches that guild's row.
+
+    Rows are kept in memory after their first read, a row another process wrote is read from disk on a miss.
+    """
+    fields = ('channel', 'sheet')
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS guilds (guild TEXT PRIMARY KEY, channel INTEGER, sheet TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.rows = {guild: {'channel': channel, 'sheet': sheet}
+                     for guild, channel, sheet in self.db.execute('SELECT guild, channel, sheet FROM guilds')}
+
+    def get(self, guildID, field):
+        if guildID not in self.rows:
+            row = self.db.execute('SELECT channel, sheet FROM guilds WHERE guild = ?', (guildID,)).fetchone()
+            if row is None:
+                return None
+            self.rows[guildID] = dict(zip(self.fields, row))
+        return self.rows[guildID][field]
+
+    def set(self, guildID, field, value):
+        self.db.execute(f'''INSERT INTO guilds (guild, {field}) VALUES (?, ?)
+                            ON CONFLICT (guild) DO UPDATE SET {field} = excluded.{field}''', (guildID, value))
+        self.rows.setdefault(guildID, dict.fromkeys(self.fields))[field] = value
+
+    def get_meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row and row[0]
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value', (key, value))
+
+    def migrate_json(self, channelsFile, sheetsFile):
+        """Copy channels.json and active_stats.json in the first time the store is opened next to them."""
+        if self.get_meta('migrated_json'):
+            return
+        for path, field in ((channelsFile, 'channel'), (sheetsFile, 'sheet')):
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    for guildID, value in json.load(f).items():
+                        if self.get(guildID, field) is None:
+                            self.set(guildID, field, value)
+                print(f'moved {path} into {database_file}')
+        self.set_meta('migrated_json', datetime.now().isoformat())
+
+class GuildSetting:
+    """Dict-like view of one ConfigStore field, keyed by the guild ID as a string."""
+    def __init__(self, store, field):
+        self.store = store
+        self.field = field
+
+    def __getitem__(self, guildID):
+        value = self.store.get(guildID, self.field)
+        if value is None:
+            raise KeyError(guildID)
+        return value
+
+    def __setitem__(self, guildID, value):
+        self.store.set(guildID, self.field, value)
+
+    def __contains__(self, guildID):
+        return self.store.get(guildID, self.field) is not None
+
+    def get(self, guildID, default=None):
+        value = self.store.get(guildID, self.field)
+        return default if value is None else value
 
 def is_correct_channel(interaction: discord.Interaction):
     return str(interaction.guild.id) in channels and channels[str(interaction.guild.id)] == interaction.channel.id
-def is_active_game(interaction: discord.Interaction):
-    return interaction.guild.id in active_game
 
-def load_active_stats():
-    if os.path.exists(active_stats_file):
-        with open(active_stats_file, 'r') as f:
-            return json.load(f)
-    return {}
-def save_active_stats(active_stats):
-    with open(active_stats_file, 'w') as f:
-        json.dump(active_stats, f, indent=4)
-
-channels = load_channels()
-active_sheets = load_active_stats()
-
-class MyView(View):
-    def __init__(self, players, commanders):
-        super().__init__()
+config = ConfigStore(database_file)
+config.migrate_json(channels_file, active_stats_file)
+channels = GuildSetting(config, 'channel')
+active_sheets = GuildSetting(config, 'sheet')
+
+def guild_lock(guildID):
+    if guildID not in guild_locks:
+        guild_locks[guildID] = asyncio.Lock()
+    return guild_locks[guildID]
+
+def count_api_call(response, *args, **kwargs):
+    api_calls.count = getattr(api_calls, 'count', 0) + 1
+
+def counted(enqueued, func, *args, **kwargs):
+    """Run func and return its result with how many Google round trips it made."""
+    google_scheduler.started(enqueued)
+    api_calls.count = 0
+    result = func(*args, **kwargs)
+    return result, api_calls.count
+
+async def run_sheets(guildID, func, *args, **kwargs):
+    """Run a blocking Google call in the sheets pool, one call at a time per guild."""
+    enqueued = google_scheduler.enqueue()
+    # the sheets thread runs in a copy of this context, so its requests count for the guild
+    context = contextvars.copy_context()
+    context.run(current_guild.set, guildID)
+    async with guild_lock(guildID):
+        loop = asyncio.get_running_loop()
+        try:
+            with metrics.span('sheets_job', job=getattr(func, '__name__', str(func))):
+                result, calls = await loop.run_in_executor(sheets_executor, partial(context.run, counted, enqueued, func, *args, **kwargs))
+        except (gspread.exceptions.GSpreadException, PermissionError):
+            # the cached worksheets may be what is broken, so open the spreadsheet again next time
+            invalidate_spreadsheet(active_sheets.get(str(guildID)))
+            raise
+        print(f'{getattr(func, "__name__", func)} took {calls} Google call(s)')
+        return result
+
+async def read_sheets(guildID, func, *args):
+    """run_sheets for reads, where everyone asking for the same read while it runs shares one request."""
+    key = (guildID, func, args)
+    if key in sheets_reads:
+        google_scheduler.note('coalesced')
+    else:
+        sheets_reads[key] = asyncio.ensure_future(run_sheets(guildID, func, *args))
+        sheets_reads[key].add_done_callback(lambda future: sheets_reads.pop(key, None))
+    return await asyncio.shield(sheets_reads[key])
+
+def execute(request):
+    """Send a Drive or Sheets discovery request through the scheduler."""
+    kind = 'drive' if 'googleapis.com/drive' in request.uri else 'sheets_write' if request.method != 'GET' else 'sheets_read'
+    return google_scheduler.call(kind, request.execute, endpoint=endpoint_name(request.method, request.uri),
+                                 idempotent=idempotent_request(request.method, request.uri))
+
+class GameJournal:
+    """Append-only log of addgame and finishgame events, written before anything goes to Google.
+
+    Every event is committed (and fsynced) to SQLite straight away, the flusher pushes the
+    pending ones to RawData later and marks them synced with where they landed.
+    """
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS journal (
+                               seq     INTEGER PRIMARY KEY AUTOINCREMENT,
+                               guild   INTEGER NOT NULL,
+                               game    TEXT NOT NULL,
+                               event   TEXT NOT NULL,
+                               payload TEXT NOT NULL,
+                               synced  INTEGER NOT NULL DEFAULT 0,
+                               result  TEXT)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS journal_game ON journal (game, event)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS journal_pending ON journal (synced, guild)')
+        # finish buttons pressed so far, so a half finished game survives a restart too
+        self.db.execute('''CREATE TABLE IF NOT EXISTS picks (
+                               game   TEXT NOT NULL,
+                               stat   INTEGER NOT NULL,
+                               player TEXT NOT NULL,
+                               PRIMARY KEY (game, stat))''')
+
+    def record(self, guildID, gameID, event, payload):
+        cursor = self.db.execute('INSERT INTO journal (guild, game, event, payload) VALUES (?, ?, ?, ?)',
+                                 (guildID, gameID, event, json.dumps(payload)))
+        return cursor.lastrowid
+
+    def pending(self):
+        """Every event of this process's guilds not yet in a spreadsheet, oldest first."""
+        owned, params = owned_guilds_sql('guild')
+        rows = self.db.execute(f'SELECT seq, guild, game, event, payload FROM journal WHERE synced = 0 AND {owned} ORDER BY seq', params)
+        return [(seq, guild, game, event, json.loads(payload)) for seq, guild, game, event, payload in rows]
+
+    def mark_synced(self, seq, result=None):
+        self.db.execute('UPDATE journal SET synced = 1, result = ? WHERE seq = ?', (json.dumps(result), seq))
+
+    def mark_attempt(self, seq, gameNumber):
+        """Note the number an add is about to be appended as, in case the append lands without the bot hearing back."""
+        self.db.execute('UPDATE journal SET result = ? WHERE seq = ? AND synced = 0', (json.dumps({'attempt': gameNumber}), seq))
+
+    def attempt(self, seq):
+        row = self.db.execute('SELECT result FROM journal WHERE seq = ? AND synced = 0', (seq,)).fetchone()
+        return json.loads(row[0])['attempt'] if row and row[0] else None
+
+    def synced_result(self, gameID, event):
+        row = self.db.execute('SELECT result FROM journal WHERE game = ? AND event = ? AND synced = 1',
+                              (gameID, event)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def finished_games(self, guildID):
+        """Every finished game of a guild with its game number once its add has been synced."""
+        rows = self.db.execute('''SELECT added.payload, added.result, finished.payload FROM journal AS finished
+                                  JOIN journal AS added ON added.game = finished.game AND added.event = 'addgame'
+                                  WHERE finished.event = 'finishgame' AND finished.guild = ?
+                                  ORDER BY finished.seq''', (guildID,))
+        games = []
+        for added, result, finished in rows:
+            added, result, finished = json.loads(added), json.loads(result) if result else None, json.loads(finished)
+            games.append((added['sheet'], result.get('game') if result else None, added['players'], added['commanders'], finished['stats']))
+        return games
+
+    def record_pick(self, gameID, stat, player):
+        self.db.execute('INSERT OR IGNORE INTO picks (game, stat, player) VALUES (?, ?, ?)', (gameID, stat, player))
+
+    def picks(self, gameID):
+        """Finish buttons already pressed for a game, as column -> player."""
+        return dict(self.db.execute('SELECT stat, player FROM picks WHERE game = ?', (gameID,)))
+
+    def active_games(self):
+        """Games of this process's guilds that were added but never finished, by guild and game ID."""
+        owned, params = owned_guilds_sql('added.guild')
+        rows = self.db.execute(f'''SELECT guild, game, payload FROM journal AS added
+                                   WHERE event = 'addgame' AND {owned} AND NOT EXISTS
+                                   (SELECT 1 FROM journal WHERE game = added.game AND event = 'finishgame')
+                                   ORDER BY seq''', params)
+        games = {}
+        for guild, game, payload in rows:
+            games.setdefault(guild, {})[game] = dict(json.loads(payload), id=game)
+        return games
+
+journal = GameJournal(database_file)
+journal_wakeup = asyncio.Event()
+journal_flushing = {}
+journal_retries = {}
+flusher_task = None
+active_games.update(journal.active_games())
+
+class StatsEngine:
+    """Player and commander stats of one guild, computed from its RawData rows instead of the Tables formulas."""
+    def __init__(self, rows):
+        import pandas as pd  # only the tables need pandas, so it is not imported at startup
+
+        # RawData is a header row, then game number, player, commander, first out, won, first blood and date
+        games = pd.DataFrame([row[:6] for row in rows[1:] if len(row) >= 6 and row[1] != ''],
+                             columns=['Game', 'Player', 'Commander', 'First Out', 'Wins', 'First Blood'])
+        for column in ['Game', 'First Out', 'Wins', 'First Blood']:
+            games[column] = pd.to_numeric(games[column], errors='coerce').fillna(0).astype(int)
+        games['Player'] = games['Player'].str.capitalize()
+        games['Commander'] = games['Commander'].str.capitalize()
+
+        # a game without a winner has not been finished yet
+        games = games[games.groupby('Game')['Wins'].transform('sum') > 0]
+        self.finishedGames = set(games['Game'])
+        self.version = None  # which RawData mirror version it was built from
+        self.players = self.totals(games, 'Player')
+        self.commanders = self.totals(games, 'Commander')
+
+    @staticmethod
+    def totals(games, by):
+        totals = games.groupby(by)[['Wins', 'First Out', 'First Blood']].sum()
+        totals.insert(0, 'Games', games.groupby(by).size())
+        return totals
+
+    def add_game(self, players, commanders, stats):
+        """Count one finished game, stats being its first out, winner and first blood."""
+        for table, names in ((self.players, players), (self.commanders, commanders)):
+            for player, name in zip(players, names):
+                row = [1, int(player == stats[1]), int(player == stats[0]), int(player == stats[2])]
+                name = name.capitalize()
+                if name in table.index:
+                    table.loc[name] += row
+                else:
+                    table.loc[name] = row
+
+    @staticmethod
+    def table(totals, title):
+        """Rows ready to print, best record first, with the header row on top."""
+        table = totals.reset_index(names=title)
+        table.insert(3, 'Win %', table['Wins'] / table['Games'])
+        table = table.sort_values(['Wins', 'Win %', title], ascending=[False, False, True])
+        table['Win %'] = table['Win %'].map('{:.0%}'.format)
+        return [table.columns.tolist()] + table.values.tolist()
+
+    def player_table(self):
+        return self.table(self.players, 'Player')
+
+    def commander_table(self):
+        return self.table(self.commanders, 'Commander')
+
+stats_engines = {}
+
+async def guild_stats(guildID):
+    """The guild's stats engine, built again only when RawData was changed by someone other than the bot."""
+    sheetID = active_sheets[str(guildID)]
+    version = await mirror_version(guildID, sheetID)
+    engine = stats_engines.get(guildID)
+    if engine is None or engine.version != (sheetID, version):
+        # the rows are only copied out of the mirror when something has to be built from them
+        rows, version = await read_sheets(guildID, raw_data_rows, sheetID)
+        # the pandas build takes seconds on a long history, so it stays off the event loop
+        engine = await asyncio.get_running_loop().run_in_executor(None, StatsEngine, rows)
+        engine.version = (sheetID, version)
+
+        # finishes still waiting in the journal are not in the sheet yet
+        for sheet, gameNumber, players, commanders, stats in journal.finished_games(guildID):
+            if sheet == sheetID and gameNumber not in engine.finishedGames:
+                engine.add_game(players, commanders, stats)
+        stats_engines[guildID] = engine
+    return engine
+
+def raw_data_games(rows):
+    """Every finished game in RawData rows by game number, as its seats in order.
+
+    A seat is player, commander, first out, won and first blood.
+    """
+    games = {}
+    for row in rows[1:]:
+        if len(row) >= 6 and row[1] != '':
+            gameNumber = int(row[0]) if row[0].strip().isdigit() else 0
+            games.setdefault(gameNumber, []).append((row[1], row[2], *(value.strip() == '1' for value in row[3:6])))
+    # a game without a winner has not been finished yet, and one typed in with a single seat was never a game
+    return {gameNumber: seats for gameNumber, seats in games.items() if len(seats) >= 2 and any(seat[3] for seat in seats)}
+
+def finished_seats(players, commanders, stats):
+    """The seats of a journaled finish, stats being its first out, winner and first blood."""
+    return [(player, commander, *(player == stat for stat in stats)) for player, commander in zip(players, commanders)]
+
+class Ratings:
+    """Multiplayer Elo ratings of each guild's players and commanders, kept in SQLite.
+
+    A game counts as its winner beating everyone else in the pod, with K shared between
+    those pairings. A finish only touches the ratings of its pod, replay() rates a whole
+    history in one pass over it.
+    """
+    start = 1500
+    k = 32
+    kinds = {'player': 'Player', 'commander': 'Commander'}
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS ratings (
+                               guild  INTEGER NOT NULL,
+                               kind   TEXT NOT NULL,
+                               name   TEXT NOT NULL,
+                               rating REAL NOT NULL,
+                               games  INTEGER NOT NULL,
+                               PRIMARY KEY (guild, kind, name))''')
+
+    def get(self, guildID, kind, names):
+        rows = self.db.execute(f'SELECT name, rating, games FROM ratings WHERE guild = ? AND kind = ? AND name IN ({", ".join("?" * len(names))})',
+                               (guildID, kind, *names))
+        return {name: (rating, games) for name, rating, games in rows}
+
+    def record_game(self, guildID, players, commanders, winner):
+        """Rate one finished game, only reading and writing the ratings of its pod."""
+        seat = players.index(winner)
+        for kind, names in (('player', players), ('commander', commanders)):
+            names = [name.capitalize() for name in names]
+            known = sorted(set(names))
+            current = self.get(guildID, kind, known)
+            ratings = [current.get(name, (self.start, 0))[0] for name in known]
+            games = [current.get(name, (self.start, 0))[1] for name in known]
+            self.rate_game(ratings, games, [known.index(name) for name in names], seat)
+            self.db.executemany('''INSERT INTO ratings (guild, kind, name, rating, games) VALUES (?, ?, ?, ?, ?)
+                                   ON CONFLICT (guild, kind, name) DO UPDATE SET rating = excluded.rating, games = excluded.games''',
+                                [(guildID, kind, name, float(ratings[i]), int(games[i])) for i, name in enumerate(known)])
+
+    @classmethod
+    def rate_game(cls, ratings, games, pod, winner):
+        """Rate one game in place, pod being indexes into ratings and winner the seat that won."""
+        best = ratings[pod[winner]]
+        share = cls.k / (len(pod) - 1)
+        gained = 0.0
+        for seat, index in enumerate(pod):
+            if seat != winner:
+                # what this seat lost to the winner, the winner gains all of it
+                lost = share / (1 + 10 ** ((best - ratings[index]) / 400))
+                ratings[index] -= lost
+                gained += lost
+            games[index] += 1
+        ratings[pod[winner]] += gained
+
+    @classmethod
+    def replay(cls, rows, journaled):
+        """Rate a guild's history in the order the finishes were rated as they happened.
+
+        Games the bot never finished (imported or typed into RawData) go first in RawData
+        order, then the journaled finishes in the order they were made, read from RawData
+        when they are in it already. Returns each kind's names, ratings and game counts.
+        """
+        games = raw_data_games(rows)
+        journaledNumbers = {gameNumber for gameNumber, players, commanders, stats in journaled}
+        pods = [seats for gameNumber, seats in games.items() if gameNumber not in journaledNumbers]
+        pods += [games[gameNumber] if gameNumber in games else finished_seats(players, commanders, stats)
+                 for gameNumber, players, commanders, stats in journaled]
+
+        rated = {}
+        for kind, column in enumerate(cls.kinds):
+            codes = {}
+            ratings, counts = [], []
+            for seats in pods:
+                pod = []
+                for seat in seats:
+                    name = seat[kind].capitalize()
+                    if name not in codes:
+                        codes[name] = len(ratings)
+                        ratings.append(float(cls.start))
+                        counts.append(0)
+                    pod.append(codes[name])
+                # the first winner listed when a game has two
+                winner = next(i for i, seat in enumerate(seats) if seat[3])
+                cls.rate_game(ratings, counts, pod, winner)
+            rated[column] = (list(codes), ratings, counts)
+        return rated
+
+    def replace(self, guildID, rated):
+        """Swap every rating of a guild for a replayed set."""
+        self.db.execute('BEGIN')
+        try:
+            self.db.execute('DELETE FROM ratings WHERE guild = ?', (guildID,))
+            for kind, (names, ratings, counts) in rated.items():
+                self.db.executemany('INSERT INTO ratings (guild, kind, name, rating, games) VALUES (?, ?, ?, ?, ?)',
+                                    [(guildID, kind, name, float(rating), int(count)) for name, rating, count in zip(names, ratings, counts)])
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def leaderboard(self, guildID, kind):
+        return self.db.execute('SELECT name, rating, games FROM ratings WHERE guild = ? AND kind = ? ORDER BY rating DESC, name',
+                               (guildID, kind)).fetchall()
+
+ratings = Ratings(database_file)
+ratings_versions = {}  # the (sheet, RawData mirror version) each guild's ratings were last replayed from
+ratings_locks = {}
+guild_finishes = Counter()  # games each guild finished since the bot started
+
+async def guild_ratings(guildID):
+    """Replay the guild's ratings when RawData changed without the bot, otherwise they are already up to date."""
+    sheetID = active_sheets[str(guildID)]
+    async with ratings_locks.setdefault(guildID, asyncio.Lock()):
+        if ratings_versions.get(guildID) == (sheetID, await mirror_version(guildID, sheetID)):
+            return
+        rows, version = await read_sheets(guildID, raw_data_rows, sheetID)
+        finishes = guild_finishes[guildID]
+        journaled = [(gameNumber, players, commanders, stats)
+                     for sheet, gameNumber, players, commanders, stats in journal.finished_games(guildID) if sheet == sheetID]
+        rated = await asyncio.get_running_loop().run_in_executor(None, Ratings.replay, rows, journaled)
+        ratings.replace(guildID, rated)
+        # a finish rated while the replay ran is not in it, so the next look replays again
+        if guild_finishes[guildID] == finishes:
+            ratings_versions[guildID] = (sheetID, version)
+        print(f'replayed ratings of {len(rows) - 1} RawData row(s) for {guildID}')
+
+class Matchups:
+    """Head to head, commander against commander and per seat records of one guild, counted once from RawData.
+
+    Each finish only adds its own game, so a question is a few dictionary lookups
+    however long the guild's history is.
+    """
+    def __init__(self):
+        self.version = None  # which RawData mirror version it was built from
+        self.finishedGames = set()
+        # kind -> name -> [games, wins, first out, first blood]
+        self.totals = {kind: {} for kind in Ratings.kinds}
+        # kind -> name -> seat -> [games, wins]
+        self.seats = {kind: {} for kind in Ratings.kinds}
+        # kind -> name -> opponent -> [games together, games name won], both ways round
+        self.versus = {kind: {} for kind in Ratings.kinds}
+        # commander -> player -> [games, wins]
+        self.pilots = {}
+        self.names = {kind: NameIndex() for kind in Ratings.kinds}
+
+    @classmethod
+    def from_rows(cls, rows):
+        games = raw_data_games(rows)
+        matchups = cls()
+        matchups.add_games(games.values())
+        matchups.finishedGames.update(games)
+        return matchups
+
+    def add_games(self, games):
+        """Count finished games, each as the seats raw_data_games() gives."""
+        for seats in games:
+            for column, kind in enumerate(Ratings.kinds):
+                names = [seat[column].capitalize() for seat in seats]
+                pod = set(names)
+                totals, seatRecords, versus = self.totals[kind], self.seats[kind], self.versus[kind]
+                for number, (name, seat) in enumerate(zip(names, seats), start=1):
+                    firstOut, won, firstBlood = seat[2:5]
+                    if name not in totals:
+                        totals[name] = [0, 0, 0, 0]
+                        seatRecords[name] = {}
+                        versus[name] = {}
+                        self.names[kind].add(name)
+                    record = totals[name]
+                    record[0] += 1
+                    record[1] += won
+                    record[2] += firstOut
+                    record[3] += firstBlood
+                    seatRecord = seatRecords[name].setdefault(number, [0, 0])
+                    seatRecord[0] += 1
+                    seatRecord[1] += won
+                    opponents = versus[name]
+                    for opponent in pod:
+                        if opponent != name:
+                            pair = opponents.setdefault(opponent, [0, 0])
+                            pair[0] += 1
+                            pair[1] += won
+            for player, commander, firstOut, won, firstBlood in seats:
+                pilot = self.pilots.setdefault(commander.capitalize(), {}).setdefault(player.capitalize(), [0, 0])
+                pilot[0] += 1
+                pilot[1] += won
+
+    def match(self, kind, name):
+        """The counted name closest to what was typed, or None."""
+        return self.names[kind].match(name.capitalize())
+
+    def head_to_head(self, kind, name, other):
+        """Games the two played together and how many each of them won."""
+        together, won = self.versus[kind].get(name, {}).get(other, [0, 0])
+        return together, won, self.versus[kind].get(other, {}).get(name, [0, 0])[1]
+
+    def opponent_table(self, kind, name, title):
+        """How name did against everyone it has met, most played first, with the header row on top."""
+        rows = []
+        for opponent, (together, won) in self.versus[kind].get(name, {}).items():
+            lost = self.versus[kind][opponent][name][1]
+            rows.append([opponent, together, won, lost, f'{won / together:.0%}'])
+        rows.sort(key=lambda row: (-row[1], -row[2], row[0]))
+        return [[title, 'Games', 'Won', 'Lost to', 'Win %']] + rows
+
+    def seat_table(self, kind, name):
+        rows = [[number, games, won, f'{won / games:.0%}'] for number, (games, won) in sorted(self.seats[kind].get(name, {}).items())]
+        return [['Seat', 'Games', 'Wins', 'Win %']] + rows
+
+matchups = OrderedDict()  # guild -> Matchups, least recently asked about first
+matchup_guilds = int(os.getenv('MatchupGuilds', 100))
+
+async def guild_matchups(guildID):
+    """The guild's matchups, counted again only when RawData was changed by someone other than the bot."""
+    sheetID = active_sheets[str(guildID)]
+    version = await mirror_version(guildID, sheetID)
+    counted = matchups.get(guildID)
+    if counted is None or counted.version != (sheetID, version):
+        rows, version = await read_sheets(guildID, raw_data_rows, sheetID)
+        counted = await asyncio.get_running_loop().run_in_executor(None, Matchups.from_rows, rows)
+        counted.version = (sheetID, version)
+
+        # finishes still waiting in the journal are not in the sheet yet
+        counted.add_games(finished_seats(players, commanders, stats) for sheet, gameNumber, players, commanders, stats in journal.finished_games(guildID)
+                          if sheet == sheetID and gameNumber not in counted.finishedGames)
+        matchups[guildID] = counted
+        print(f'counted matchups of {len(rows) - 1} RawData row(s) for {guildID}')
+    matchups.move_to_end(guildID)
+    while len(matchups) > matchup_guilds:
+        matchups.popitem(last=False)
+    return counted
+
+def chart_series(chart, rows, journaled, top=8):
+    """The points of a chart, worked out from RawData rows and journaled finishes.
+
+    Only the most played players or commanders are drawn, and a long line is thinned
+    to a few hundred points, so little has to be sent to the render process.
+    """
+    games = raw_data_games(rows)
+    dates = {row[0]: row[6] for row in rows[1:] if len(row) >= 7}
+    today = datetime.now().strftime('%m/%d/%Y')
+    finished = [(seats, dates.get(str(gameNumber), '')) for gameNumber, seats in games.items()]
+    finished += [(finished_seats(players, commanders, stats), today)
+                 for gameNumber, players, commanders, stats in journaled if gameNumber not in games]
+
+    if chart == 'winrate':
+        played = Counter(seat[0].capitalize() for seats, date in finished for seat in seats)
+        points = {player: ([], []) for player, count in played.most_common(top)}
+        record, wins = Counter(), Counter()
+        for number, (seats, date) in enumerate(finished, start=1):
+            for seat in seats:
+                player = seat[0].capitalize()
+                if player in points:
+                    record[player] += 1
+                    wins[player] += seat[3]
+                    # the first few games swing too much to be worth drawing
+                    if record[player] >= 5:
+                        points[player][0].append(number)
+                        points[player][1].append(wins[player] / record[player])
+        for player, (numbers, rates) in points.items():
+            step = max(1, len(numbers) // 400)
+            points[player] = (numbers[::step] + numbers[-1:], rates[::step] + rates[-1:])
+        return points
+
+    # games per month of the most played commanders, every month from the first game to the last
+    monthly = Counter()
+    for seats, date in finished:
+        month, day, year = (date.split('/') + ['', '', ''])[:3]
+        if month.isdigit() and year.isdigit():
+            monthly.update((int(year), int(month), seat[1].capitalize()) for seat in seats)
+    if not monthly:
+        return [], {}
+    first, last = min(monthly)[:2], max(monthly)[:2]
+    months = [(year, month) for year in range(first[0], last[0] + 1) for month in range(1, 13) if first <= (year, month) <= last]
+    played = Counter()
+    for (year, month, commander), count in monthly.items():
+        played[commander] += count
+    counts = {commander: [monthly[year, month, commander] for year, month in months] for commander, count in played.most_common(top)}
+    return [f'{year}-{month:02}' for year, month in months], counts
+
+chart_images = OrderedDict()  # (guild, chart) -> (what it was drawn from, PNG), least recently asked for first
+chart_cache_size = int(os.getenv('ChartCacheSize', 200))
+chart_processes = int(os.getenv('ChartProcesses', 2))
+
+class ChartWorkers:
+    """Processes running charts.py, each drawing one chart at a time, started the first time they are needed.
+
+    They are started as scripts of their own rather than forked or spawned by multiprocessing,
+    so they never copy the bot's threads or run its module setup again.
+    """
+    def __init__(self, processes):
+        self.processes = processes
+        self.started = 0
+        self.idle = None
+
+    async def render(self, chart, series):
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+        if self.idle.empty() and self.started < self.processes:
+            self.started += 1
+            try:
+                worker = await asyncio.create_subprocess_exec(sys.executable, charts.__file__,
+                                                              stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+            except Exception:
+                self.started -= 1
+                raise
+        else:
+            worker = await self.idle.get()
 
-        self.buttons = {i: [] for i in range(len(players))}
-        self.col0, self.col1, self.col2 = False, False, False
-        self.playerOut, self.playerWon, self.playerBlood = '', '', ''
-
-        # making each button
-        firstOutButtons = [Button(label=f'first out {players[i]}', style=discord.ButtonStyle.red) for i in range(len(players))]
-        winnerButtons = [Button(label=f'won {players[i]}', style=discord.ButtonStyle.green) for i in range(len(players))]
-        firstBloodButtons = [Button(label=f'first blood {players[i]}', style=discord.ButtonStyle.blurple) for i in range(len(players))]
-
-        #putting all buttons in the array in proper order
-        for i in range(len(players)):
-            # assigning each button the current row
-            firstOutButtons[i].row = i
-            winnerButtons[i].row = i
-            firstBloodButtons[i].row = i
-
-            #assigning each button a function
-            firstOutButtons[i].callback = partial(self.button_callback, column=0, player= players[i])
-            winnerButtons[i].callback = partial(self.button_callback, column=1, player= players[i])
-            firstBloodButtons[i].callback = partial(self.button_callback, column=2, player= players[i])
-
-            #adding the buttons to the button list
-            self.add_item(firstOutButtons[i])
-            self.add_item(winnerButtons[i])
-            self.add_item(firstBloodButtons[i])
-
-            # storing buttons in dictionary by column
-            self.buttons[i].extend([firstOutButtons[i], winnerButtons[i], firstBloodButtons[i]])
-    async def button_callback(self, interaction: discord.Interaction, column, player):
-        tempcol0, tempcol1, tempcol2 = False, False, False
-        for row in range(len(self.buttons)):
-            self.buttons[row][column].disabled = True
-
-            if column == 0 and not self.col0:
-                self.col0, tempcol0 = True, True
-                self.playerOut = player
-
-            if column == 1 and not self.col1:
-                self.col1, tempcol1 = True, True
-                self.playerWon = player
-
-            if column == 2 and not self.col2:
-                self.col2, tempcol2 = True, True
-                self.playerBlood = player
-
-        if tempcol0 and self.col0:
-            await interaction.response.edit_message(content=f'You selected: {player} for first out', view=self)
-        if tempcol1 and self.col1:
-            await interaction.response.edit_message(content=f'You selected: {player} for winning the game', view=self)
-        if tempcol2 and self.col2:
-            await interaction.response.edit_message(content=f'You selected: {player} for first blood', view=self)
-
-        if self.col0 and self.col1 and self.col2:
+        try:
+            worker.stdin.write(charts.frame(pickle.dumps((chart, series))))
+            await worker.stdin.drain()
+            size = int.from_bytes(await worker.stdout.readexactly(8), 'big')
+            drawn, result = pickle.loads(await worker.stdout.readexactly(size))
+        except BaseException:
+            # half a request or answer is left in the pipes, so the worker cannot be used again
+            worker.kill()
+            self.started -= 1
+            raise
+        self.idle.put_nowait(worker)
+        if not drawn:
+            raise result
+        return result
+
+chart_workers = ChartWorkers(chart_processes)
+
+async def guild_chart(guildID, chart):
+    """PNG of one of the guild's charts, drawn again only once a game was finished or RawData was edited."""
+    sheetID = active_sheets[str(guildID)]
+    drawnFrom = (sheetID, await mirror_version(guildID, sheetID), guild_finishes[guildID])
+    cached = chart_images.get((guildID, chart))
+    if cached is not None and cached[0] == drawnFrom:
+        chart_images.move_to_end((guildID, chart))
+        metrics.inc('chart_cache_hits', chart=chart)
+        return cached[1]
+
+    rows, version = await read_sheets(guildID, raw_data_rows, sheetID)
+    drawnFrom = (sheetID, version, guild_finishes[guildID])
+
+    journaled = [(gameNumber, players, commanders, stats)
+                 for sheet, gameNumber, players, commanders, stats in journal.finished_games(guildID) if sheet == sheetID]
+    loop = asyncio.get_running_loop()
+    series = await loop.run_in_executor(None, chart_series, chart, rows, journaled)
+    with metrics.span('chart_render', chart=chart):
+        image = await chart_workers.render(chart, series)
+    chart_images[(guildID, chart)] = (drawnFrom, image)
+    chart_images.move_to_end((guildID, chart))
+    while len(chart_images) > chart_cache_size:
+        chart_images.popitem(last=False)
+    return image
+
+# the three finish columns, as (button label, button colour, what the selection message says)
+finish_stats = [('first out', discord.ButtonStyle.red, 'first out'),
+                ('won', discord.ButtonStyle.green, 'winning the game'),
+                ('first blood', discord.ButtonStyle.blurple, 'first blood')]
+
+class FinishButton(discord.ui.DynamicItem[Button], template=r'podstats:finish:(?P<game>[0-9a-f]+):(?P<stat>[0-2]):(?P<seat>[0-4])'):
+    """A finish button whose custom_id holds its game, column and seat, so it still works after a restart."""
+    def __init__(self, gameID, stat, seat, player='', disabled=False):
+        label, style, said = finish_stats[stat]
+        super().__init__(Button(label=f'{label} {player}', style=style, row=seat, disabled=disabled,
+                                custom_id=f'podstats:finish:{gameID}:{stat}:{seat}'))
+        self.gameID, self.stat, self.seat = gameID, stat, seat
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match):
+        return cls(match['game'], int(match['stat']), int(match['seat']))
+
+    @timed('finish button')
+    async def callback(self, interaction: discord.Interaction):
+        game = active_games.get(interaction.guild.id, {}).get(self.gameID)
+        if game is None:
+            await interaction.response.send_message('This game has already been finished.', ephemeral=True)
+            return
+
+        picks = journal.picks(self.gameID)
+        if self.stat in picks:
+            await interaction.response.send_message(f'{picks[self.stat]} was already picked for {finish_stats[self.stat][2]}.', ephemeral=True)
+            return
+        player = game['players'][self.seat]
+        picks[self.stat] = player
+        journal.record_pick(self.gameID, self.stat, player)
+
+        # the finish is journaled before discord hears anything, so a failed message cannot leave the game stuck
+        finished = len(picks) == len(finish_stats)
+        if finished:
+            record_finish(interaction.guild.id, self.gameID, [picks[0], picks[1], picks[2]])
+            print(f'finishing game {self.gameID} . . .')
+
+        await interaction.response.edit_message(content=f'You selected: {player} for {finish_stats[self.stat][2]}',
+                                                view=MyView(game, picks))
+        if finished:
             await interaction.followup.send(f'Your selection: \n'
-                                            f'player that got out first:{self.playerOut},\n'
-                                            f'player that won {self.playerWon},\n'
-                                            f'player that died first: {self.playerBlood}\n\n'
+                                            f'player that got out first:{picks[0]},\n'
+                                            f'player that won {picks[1]},\n'
+                                            f'player that died first: {picks[2]}\n\n'
                                             f'Finishing game!')
 
-            sheetID = active_sheets[str(interaction.guild.id)]
-
-            Title, Tables, RawData, Validations = get_sheets(sheetID)
-            spreadsheet = client.open(Title)
-
-            finish_game_stats(interaction, players= [self.playerOut, self.playerWon, self.playerBlood], RawData=spreadsheet.worksheet(RawData))
-        # Update the label to show it has been clicked
-        #await interaction.message.edit(content=interaction.message.content, view=self)
-
-def finish_game_stats(interaction: discord.Interaction, players, RawData):
-    gameNumber = RawData.col_values(2)  # Get all values in the column
-    lastGameRow = len(gameNumber) - 3  # The last filled row is the length of the list
-    newGameNumber = math.ceil((lastGameRow) / 4)
-    print(f'finishing game {active_game[interaction.guild.id]} . . .')
-
-    #grab todays date
-    now = datetime.now()
-    # Format the date as MM/DD/YYYY
-    formattedDate = now.strftime('%m/%d/%Y')
-
-    startRow = lastGameRow  # Ensure start_row is at least 1
-    endRow = lastGameRow + 3
-
-    # Fetch the last 4 rows in columns D, E, and F
-    rangeString = f'B{startRow}:F{endRow}'
-    last4Rows = RawData.get(rangeString)
-
-
-    for row in last4Rows:
-        if row[0] in players:
-            for i, stat in enumerate(players):
-                if stat == row[0]:
-                    row[i+2] = 1
-
-        # Update the spreadsheet with the modified rows
-    for i, updatedRow in enumerate(last4Rows):
-        cell_range = f'B{startRow + i}:F{startRow + i}'
-        RawData.update([updatedRow], cell_range)
-    del active_game[interaction.guild.id]
-    print(f'game {newGameNumber} edited on {formattedDate}')
+class MyView(View):
+    """Finish buttons for a game, a row per player, with the columns already picked disabled."""
+    def __init__(self, game, picks):
+        super().__init__(timeout=None)
 
-def game_to_sheet(players, commanders, RawData):
-    gameNumber = RawData.col_values(1)  # Get all values in the column
-    lastGameRow = len(gameNumber)  # The last filled row is the length of the list
-    newGameNumber = math.ceil((lastGameRow) / 4)
+        for seat, player in enumerate(game['players']):
+            for stat in range(len(finish_stats)):
+                self.add_item(FinishButton(game['id'], stat, seat, player, disabled=stat in picks))
 
-    #grab todays date
-    now = datetime.now()
-    # Format the date as MM/DD/YYYY
-    formattedDate = now.strftime('%m/%d/%Y')
+class TablePages(View):
+    """Previous and next buttons for a table too long for one discord message."""
+    def __init__(self, pages):
+        super().__init__()
+        self.pages = pages
+        self.page = 0
+
+        self.previousButton = Button(label='previous', style=discord.ButtonStyle.grey)
+        self.nextButton = Button(label='next', style=discord.ButtonStyle.grey)
+        self.previousButton.callback = partial(self.turn_page, step=-1)
+        self.nextButton.callback = partial(self.turn_page, step=1)
+        self.add_item(self.previousButton)
+        self.add_item(self.nextButton)
+        self.update_buttons()
+
+    def update_buttons(self):
+        self.previousButton.disabled = self.page == 0
+        self.nextButton.disabled = self.page == len(self.pages) - 1
+
+    def content(self):
+        return f'```\n{self.pages[self.page]}\n```page {self.page + 1}/{len(self.pages)}'
+
+    @timed('table page')
+    async def turn_page(self, interaction: discord.Interaction, step):
+        self.page = max(0, min(len(self.pages) - 1, self.page + step))
+        self.update_buttons()
+        await interaction.response.edit_message(content=self.content(), view=self)
+
+def format_table(rows):
+    """Line up the columns of a table, one string per row."""
+    # Determine the maximum width for each column
+    col_widths = [max(len(str(item)) for item in col) for col in zip(*rows)]
+    return [" | ".join(f"{str(item):<{col_widths[i]}}" for i, item in enumerate(row)) for row in rows]
+
+def paginate(lines, limit=1900):
+    """Split table lines into pages that fit in a discord message, each starting with the header line."""
+    header, pages, page = lines[0], [], [lines[0]]
+    for line in lines[1:]:
+        if len(page) > 1 and sum(len(pageLine) + 1 for pageLine in page) + len(line) > limit:
+            pages.append('\n'.join(page))
+            page = [header]
+        page.append(line)
+    pages.append('\n'.join(page))
+    return pages
+
+async def send_table(interaction: discord.Interaction, rows, name, ephemeral=False):
+    """Send a whole table with one followup, paged with buttons and attached as a file when it is too long."""
+    lines = format_table(rows)
+    pages = paginate(lines)
+
+    if len(pages) == 1:
+        await interaction.followup.send(f'```\n{pages[0]}\n```', ephemeral=ephemeral)
+    else:
+        view = TablePages(pages)
+        tableFile = discord.File(io.BytesIO('\n'.join(lines).encode()), filename=f'{name}.txt')
+        await interaction.followup.send(view.content(), view=view, file=tableFile, ephemeral=ephemeral)
+
+def finish_game_stats(games, RawData, mirror):
+    """Mark first out, won and first blood of every finished game with one batch update.
+
+    Returns the rows each game was written to, None for a game that is no longer in RawData.
+    """
+    data, written = [], []
+    for gameNumber, rows, players, stats in games:
+        # rows may have been inserted, deleted or sorted by hand since the add, so the game is checked for first
+        if not holds_game(mirror, rows, gameNumber, players):
+            rows = find_game_rows(mirror, gameNumber, players)
+            if rows is None:
+                print(f'game {gameNumber} is no longer in RawData, its finish was not written')
+                written.append(None)
+                continue
+        written.append(tuple(rows))
+        # first out, won and first blood go in columns D, E and F of the game's rows
+        data.append({'range': f'D{rows[0]}:F{rows[1]}',
+                     'values': [[int(player == stat) for stat in stats] for player in players]})
+    if data:
+        RawData.batch_update(data)
+    for update in data:
+        mirror.wrote(range_rows(update['range'])[0], 4, update['values'])
+
+    print(f'edited {len(data)} game(s) on {datetime.now().strftime("%m/%d/%Y")}')
+    return written
+
+def game_to_sheet(games, RawData, mirror, planned=None):
+    """Append the rows of every game with one call and return each game's number and rows.
+
+    A game with 'stats' (first out, winner and first blood) is written already finished.
+    planned, when given, is called with the first game's number before anything is sent.
+    """
+    newGameNumber = next_game_number([row[0] for row in mirror.rows])
+    if planned is not None:
+        planned(newGameNumber)
+
+    rows = []
+    for i, game in enumerate(games):
+        stats = game.get('stats', [None] * len(finish_stats))
+        rows.extend([newGameNumber + i, player.capitalize(), commander.capitalize()] + [int(player == stat) for stat in stats] + [game['date']]
+                    for player, commander in zip(game['players'], game['commanders']))
+    response = RawData.append_rows(rows)
+    startRow, endRow = range_rows(response['updates']['updatedRange'])
+    if startRow != len(mirror.rows) + 1:
+        # the sheet had rows the mirror did not, so the mirror has to be read again
+        mirror.modified = None
+    mirror.wrote(startRow, 1, rows)
+
+    written = []
+    for i, game in enumerate(games):
+        written.append((newGameNumber + i, (startRow, startRow + len(game['players']) - 1)))
+        startRow += len(game['players'])
+    print(f'Added game(s) {newGameNumber}-{newGameNumber + len(games) - 1} . . .')
+    return written
+
+def next_game_number(gameNumbers):
+    """One more than the highest game number in RawData's first column, whatever size the pods were."""
+    return max((int(value) for value in gameNumbers[1:] if str(value).strip().isdigit()), default=0) + 1
+
+def range_rows(updatedRange):
+    """Turn a range like 'RawData'!A6:G9 into its first and last row numbers."""
+    cells = updatedRange.split('!')[-1]
+    start, end = cells.split(':') if ':' in cells else (cells, cells)
+    return gspread.utils.a1_to_rowcol(start)[0], gspread.utils.a1_to_rowcol(end)[0]
+
+raw_data_columns = ['Game', 'Player', 'Commander', 'First Out', 'Won', 'First Blood', 'Date']
+# RawData rows per append while importing, well under the size of request Sheets accepts
+import_chunk_rows = int(os.getenv('ImportChunkRows', 5000))
+
+class GameImport:
+    """Checks the rows of an uploaded CSV a few lines at a time and turns them into games for game_to_sheet.
+
+    Rows of one game share its number, the columns are RawData's or named by a header row.
+    Names are matched against the roster more strictly than /addgame does, a name nothing
+    is close to is kept as written and remembered as new.
+    """
+    cutoff = 0.8
+    headers = {'game': 0, 'player': 1, 'commander': 2, 'first out': 3, 'won': 4, 'wins': 4, 'first blood': 5, 'date': 6}
+
+    def __init__(self, roster):
+        self.roster = roster
+        self.columns = None  # where each RawData column is in the file
+        self.lineNumber = 0
+        self.number = None  # the game being read, its first line and its rows
+        self.firstLine = 0
+        self.rows = []
+        self.skipped = []  # (line, why) of every game left out
+        self.newNames = {'A': set(), 'D': set()}
+        self.matched = {}  # (column, name as written) -> name in the roster
+
+    def feed(self, lines):
+        """Read more lines of the file, returning the games they finished."""
+        games = []
+        for row in csv.reader(lines):
+            self.lineNumber += 1
+            if self.lineNumber == 1 and row:
+                row[0] = row[0].lstrip('\ufeff')  # spreadsheet programs often start a CSV with a byte order mark
+            if not any(cell.strip() for cell in row):
+                continue
+            if self.columns is None and self.header(row):
+                continue
+            cells = [row[i].strip() if i is not None and i < len(row) else '' for i in self.columns]
+            if cells[0] != self.number:
+                games.extend(self.close())
+                self.number, self.firstLine = cells[0], self.lineNumber
+            self.rows.append(cells)
+        return games
+
+    def header(self, row):
+        """Take the column order from the first row, returning whether it was a header rather than a game."""
+        if row[0].strip().isdigit():
+            self.columns = list(range(len(raw_data_columns)))
+            return False
+        found = {self.headers[cell.strip().lower()]: i for i, cell in enumerate(row) if cell.strip().lower() in self.headers}
+        self.columns = [found.get(column) for column in range(len(raw_data_columns))]
+        return True
+
+    def close(self):
+        """Finish the game being read, returning it unless something is wrong with it."""
+        rows, self.rows = self.rows, []
+        if not rows:
+            return []
+        try:
+            return [self.game(rows)]
+        except ValueError as error:
+            self.skipped.append((self.firstLine, str(error)))
+            return []
+
+    def game(self, rows):
+        if not self.number:
+            raise ValueError('no game number')
+        if any(not row[1] or not row[2] for row in rows):
+            raise ValueError('a row is missing its player or commander')
+        players = [self.match('D', row[1]) for row in rows]
+        if len(rows) < 2 or len(set(players)) < len(players):
+            raise ValueError(f'game {self.number} needs at least two different players')
+
+        stats = []
+        for column in range(3, 6):
+            flags = [row[column] or '0' for row in rows]
+            if any(flag not in ('0', '1') for flag in flags) or flags.count('1') > 1:
+                raise ValueError(f'{raw_data_columns[column]} of game {self.number} must be 1 for at most one player and 0 for the rest')
+            stats.append(players[flags.index('1')] if '1' in flags else None)
+        return {'players': players, 'commanders': [self.match('A', row[2]) for row in rows], 'stats': stats,
+                'date': rows[0][6] or datetime.now().strftime('%m/%d/%Y')}
+
+    def match(self, column, name):
+        key = (column, name)
+        if key not in self.matched:
+            match = self.roster.index(column).match(name.capitalize(), cutoff=self.cutoff)
+            if match is None:
+                match = name.capitalize()
+                self.newNames[column].add(match)
+            self.matched[key] = match
+        return self.matched[key]
+
+def raw_data_chunks(rows, chunkRows):
+    """The game rows of RawData chunkRows at a time, each padded to every column, so only one chunk is ever copied."""
+    for start in range(1, len(rows), chunkRows):
+        yield [(row + [''] * len(raw_data_columns))[:len(raw_data_columns)] for row in rows[start:start + chunkRows] if len(row) > 1 and row[1] != '']
+
+def write_export(chunks, fileType):
+    """Write chunks of RawData rows to a temporary file as they come, which moves to disk once it gets big."""
+    exported = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    count = 0
+
+    if fileType == 'parquet':
+        import pyarrow  # optional, only parquet exports need it
+        import pyarrow.parquet
+        numbers = [0, 3, 4, 5]
+        schema = pyarrow.schema([(name, pyarrow.int64() if i in numbers else pyarrow.string()) for i, name in enumerate(raw_data_columns)])
+        with pyarrow.parquet.ParquetWriter(exported, schema) as writer:
+            for chunk in chunks:
+                columns = [[int(row[i]) if str(row[i]).strip().isdigit() else None for row in chunk] if i in numbers else [str(row[i]) for row in chunk]
+                           for i in range(len(raw_data_columns))]
+                writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+                count += len(chunk)
+    else:
+        text = io.TextIOWrapper(exported, encoding='utf-8', newline='', write_through=True)
+        writer = csv.writer(text)
+        writer.writerow(raw_data_columns)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            count += len(chunk)
+        text.detach()
+    exported.seek(0)
+    return exported, count
+
+def export_raw_data(spreadsheetID, fileType, chunkRows=10000):
+    """Export RawData straight from the mirror, which the guild's lock keeps still while it is read."""
+    return write_export(raw_data_chunks(synced_mirror(spreadsheetID).rows, chunkRows), fileType)
+
+def record_game(guildID, players, commanders):
+    """Journal a new game, the spreadsheet catches up in the background."""
+    game = {'sheet': active_sheets[str(guildID)], 'players': players, 'commanders': commanders,
+            'date': datetime.now().strftime('%m/%d/%Y')}
+    # the journal looks games up by this ID across every guild, so it has to be the whole uuid
+    gameID = uuid4().hex
+    journal.record(guildID, gameID, 'addgame', game)
+    game = active_games.setdefault(guildID, {})[gameID] = dict(game, id=gameID)
+    journal_wakeup.set()
+    return game
+
+def record_finish(guildID, gameID, stats):
+    """Journal the first out, winner and first blood of one of the guild's active games."""
+    game = active_games[guildID].pop(gameID)
+    if not active_games[guildID]:
+        del active_games[guildID]
+    journal.record(guildID, game['id'], 'finishgame', {'sheet': game['sheet'], 'players': game['players'], 'stats': stats})
+    if guildID in stats_engines:
+        stats_engines[guildID].add_game(game['players'], game['commanders'], stats)
+    if guildID in matchups:
+        matchups[guildID].add_games([finished_seats(game['players'], game['commanders'], stats)])
+    ratings.record_game(guildID, game['players'], game['commanders'], stats[1])
+    guild_finishes[guildID] += 1
+    journal_wakeup.set()
+    return game
+
+async def flush_journal(guildID, sheetID, events):
+    """Push one guild's pending events to its RawData sheet, adds first so finishes know their rows."""
+    adds = [(seq, payload) for seq, game, event, payload in events if event == 'addgame']
+    attempts = [(seq, journal.attempt(seq), payload) for seq, payload in adds]
+    attempts = [(seq, gameNumber, payload) for seq, gameNumber, payload in attempts if gameNumber is not None]
+    if attempts:
+        # an append that failed may still have landed, so those games are looked for before being sent again
+        landed = await run_sheets(guildID, landed_games, sheetID, [(gameNumber, payload) for seq, gameNumber, payload in attempts])
+        found = {seq for (seq, gameNumber, payload), rows in zip(attempts, landed) if rows}
+        for (seq, gameNumber, payload), rows in zip(attempts, landed):
+            if rows:
+                journal.mark_synced(seq, {'game': gameNumber, 'rows': rows})
+        adds = [(seq, payload) for seq, payload in adds if seq not in found]
+    if adds:
+        loop = asyncio.get_running_loop()
+
+        async def mark_attempts(firstNumber):
+            for i, (seq, payload) in enumerate(adds):
+                journal.mark_attempt(seq, firstNumber + i)
+
+        def planned(firstNumber):
+            # called from the sheets thread once the games are numbered, the journal is written on the event loop
+            asyncio.run_coroutine_threadsafe(mark_attempts(firstNumber), loop).result()
+
+        # numbered and appended in one job, so nothing else can append in between
+        written = await run_sheets(guildID, add_games, sheetID, [payload for seq, payload in adds], planned)
+        for (seq, payload), (gameNumber, rows) in zip(adds, written):
+            journal.mark_synced(seq, {'game': gameNumber, 'rows': rows})
+        await note_own_write(guildID, sheetID)
+
+    finishes = []
+    for seq, game, event, payload in events:
+        added = journal.synced_result(game, 'addgame') if event == 'finishgame' else None
+        # a finish waits in the journal until its game has rows to edit
+        if added:
+            finishes.append((seq, added, payload))
+    if finishes:
+        written = await run_sheets(guildID, finish_games, sheetID,
+                                   [(added['game'], added['rows'], payload['players'], payload['stats']) for seq, added, payload in finishes])
+        for (seq, added, payload), rows in zip(finishes, written):
+            journal.mark_synced(seq, dict(added, rows=rows))
+        await note_own_write(guildID, sheetID)
+
+async def sync_guild(key, events):
+    guildID, sheetID = key
+    current_guild.set(guildID)
+    try:
+        await flush_journal(guildID, sheetID, events)
+        journal_retries.pop(key, None)
+    except Exception as error:
+        failures = journal_retries.get(key, (0, 0))[0] + 1
+        delay = min(journal_max_backoff, 2 ** failures) * random.uniform(0.5, 1.5)
+        journal_retries[key] = (failures, time.monotonic() + delay)
+        print(f'could not sync games for guild {guildID}, retrying in {delay:.0f}s: {error!r}')
+    finally:
+        del journal_flushing[key]
+
+async def journal_flusher():
+    """Keep pushing journaled games to the spreadsheets, backing off per guild while Google fails."""
+    while True:
+        try:
+            await asyncio.wait_for(journal_wakeup.wait(), timeout=journal_flush_seconds)
+        except asyncio.TimeoutError:
+            pass
+        journal_wakeup.clear()
 
-    for i in range(len(players)):
-        row = [newGameNumber, players[i].capitalize(), commanders[i].capitalize(), 0, 0, 0, formattedDate]
-        RawData.append_row(row)
+        batches = {}
+        for seq, guild, game, event, payload in journal.pending():
+            batches.setdefault((guild, payload['sheet']), []).append((seq, game, event, payload))
 
-    print(f'Added game {newGameNumber} on {formattedDate}')
+        now = time.monotonic()
+        for key, events in batches.items():
+            if key not in journal_flushing and journal_retries.get(key, (0, 0))[1] <= now:
+                journal_flushing[key] = asyncio.create_task(sync_guild(key, events))
 
 def list_files():
-    results = drive_service.files().list(
+    results = execute(google_client('drive').files().list(
         q="mimeType='application/vnd.google-apps.spreadsheet'",
         pageSize=10,
         fields="nextPageToken, files(id, name)"
-    ).execute()
+    ))
     items = results.get('files', [])
 
     if not items:
@@ -201,51 +1557,531 @@ def list_files():
             print(f"{item['name']} ({item['id']})")
         return items
 
-def get_sheets(spreadsheetID):
-    """Retrieve the names of all sheets in the spreadsheet."""
-    sheetMetadata = sheets_service.spreadsheets().get(spreadsheetId=spreadsheetID).execute()
-    title = sheetMetadata.get('properties', {}).get('title')
-    sheets = sheetMetadata.get('sheets', [])
-    sheetNames = [sheet['properties']['title'] for sheet in sheets]
-
-    return title, sheetNames[0], sheetNames[1], sheetNames[2]
-def data_refresh(Valid):
-    # Get all values from the sheet
-    data = Valid.get_all_values()
-
-    # Print the data
-    listOfCommanders = []
-    listOfPlayers = []
-
-    for row in data:
-        if row[0] != '':
-            listOfCommanders.append(row[0].capitalize())
-        if row[3] != '':
-            listOfPlayers.append(row[3].capitalize())
-    #remove column title
-    listOfPlayers = listOfPlayers[1:]
-    listOfCommanders = listOfCommanders[1:]
-
-    #alphabatize
-    listOfPlayers.sort()
-    listOfCommanders.sort()
-
-    print('Grabbed player and commander names from spreadsheet . . .')
-    return listOfPlayers, listOfCommanders
-
-def correct_name(inputNames, knownNames):
+class SheetHandles:
+    """Opened Tables, RawData and Validations worksheets of one spreadsheet."""
+    def __init__(self, spreadsheet, tables, rawData, validations):
+        self.spreadsheet = spreadsheet
+        self.tables = tables
+        self.rawData = rawData
+        self.validations = validations
+        self.opened = time.monotonic()
+
+    def expired(self):
+        return time.monotonic() - self.opened > sheet_cache_ttl
+
+def open_spreadsheet(spreadsheetID):
+    """Return the worksheets of a spreadsheet, only opening it again when the cached handles are missing or stale."""
+    handles = sheet_cache.get(spreadsheetID)
+    if handles is None or handles.expired():
+        spreadsheet = google_client('gspread').open_by_key(spreadsheetID)
+        Tables, RawData, Validations = spreadsheet.worksheets()[:3]
+        handles = SheetHandles(spreadsheet, Tables, RawData, Validations)
+        sheet_cache[spreadsheetID] = handles
+        print(f'opened spreadsheet {spreadsheetID} . . .')
+    return handles
+
+def invalidate_spreadsheet(spreadsheetID):
+    sheet_cache.pop(spreadsheetID, None)
+
+# a write checks the mirror against Drive first, or saw_own_write() would take in edits made before it
+def add_games(spreadsheetID, games, planned=None):
+    return game_to_sheet(games, open_spreadsheet(spreadsheetID).rawData, synced_mirror(spreadsheetID, maxAge=0), planned)
+
+def import_games(spreadsheetID, games):
+    """Append a chunk of imported games, numbered and written in one job so the flusher cannot take their numbers."""
+    mirror = synced_mirror(spreadsheetID, maxAge=0)
+    firstNumber = next_game_number([row[0] for row in mirror.rows])
+    try:
+        return game_to_sheet(games, open_spreadsheet(spreadsheetID).rawData, mirror)
+    except (gspread.exceptions.APIError, requests.RequestException):
+        # appends are not retried for us, and this one may have landed before the error
+        if not all(landed_games(spreadsheetID, [(firstNumber + i, game) for i, game in enumerate(games)])):
+            raise
+
+def landed_games(spreadsheetID, games):
+    """The rows of each (game number, game) already in RawData, or None, read fresh from the sheet."""
+    mirror = raw_data_mirrors.setdefault(spreadsheetID, RawDataMirror(spreadsheetID))
+    mirror.modified = None
+    mirror.sync(open_spreadsheet(spreadsheetID).rawData, raw_data_check_seconds)
+    # the number alone is not enough, an import may have used it in the meantime
+    return [find_game_rows(mirror, gameNumber, game['players'], game['commanders']) for gameNumber, game in games]
+
+def holds_game(mirror, rows, gameNumber, players):
+    """Whether the mirror's (first, last) rows are exactly the game with this number and these players."""
+    startRow, endRow = rows
+    found = mirror.rows[startRow - 1:endRow]
+    return (endRow - startRow + 1 == len(players) == len(found)
+            and all(row[0] == str(gameNumber) and row[1] == player.capitalize() for row, player in zip(found, players)))
+
+def find_game_rows(mirror, gameNumber, players, commanders=None):
+    """The (first, last) rows holding a game in the mirror, found by its number and seats, or None."""
+    rows = [i for i, row in enumerate(mirror.rows, start=1) if row[0] == str(gameNumber)]
+    if not rows or not holds_game(mirror, (rows[0], rows[-1]), gameNumber, players):
+        return None
+    if commanders is not None and [mirror.rows[i - 1][2] for i in rows] != [commander.capitalize() for commander in commanders]:
+        return None
+    return rows[0], rows[-1]
+
+def finish_games(spreadsheetID, games):
+    return finish_game_stats(games, open_spreadsheet(spreadsheetID).rawData, synced_mirror(spreadsheetID, maxAge=0))
+
+def write_validation_names(spreadsheetID, column, startRow, names):
+    """Write names into a Validations column (A for commanders, D for players) starting at startRow."""
+    update_range = f"{column}{startRow}:{column}{startRow + len(names) - 1}"
+    open_spreadsheet(spreadsheetID).validations.update([[name] for name in names], update_range)
+
+def validation_values(spreadsheetID):
+    return open_spreadsheet(spreadsheetID).validations.get_all_values()
+
+def raw_data_rows(spreadsheetID):
+    """A copy of the RawData rows, and the mirror version they came from."""
+    mirror = synced_mirror(spreadsheetID)
+    return [list(row) for row in mirror.rows], mirror.version
+
+def saw_own_write(spreadsheetID):
+    if spreadsheetID in raw_data_mirrors:
+        raw_data_mirrors[spreadsheetID].saw_own_write()
+
+async def note_own_write(guildID, spreadsheetID):
+    """Take modifiedTime after the bot wrote RawData, as a job of its own so failing here cannot fail the write."""
+    try:
+        await run_sheets(guildID, saw_own_write, spreadsheetID)
+    except Exception as error:
+        # the mirror then sees a modifiedTime it does not know and reads RawData again, slower but still right
+        print(f'could not note our own write to {spreadsheetID}: {error!r}')
+
+def raw_data_version(spreadsheetID):
+    return synced_mirror(spreadsheetID).version
+
+async def mirror_version(guildID, spreadsheetID):
+    """The RawData mirror version, only going through the sheets pool when the mirror is due a look at Drive."""
+    mirror = raw_data_mirrors.get(spreadsheetID)
+    if mirror is not None and mirror.fresh(raw_data_check_seconds):
+        return mirror.version
+    return await read_sheets(guildID, raw_data_version, spreadsheetID)
+
+class RawDataMirror:
+    """A local copy of one spreadsheet's RawData, so reading game history does not mean reading the sheet.
+
+    The bot's own appends and edits are applied to the copy as they are written. The copy is
+    checked against Drive's modifiedTime right before each of them and the new modifiedTime is
+    noted after, so an edit made before the write is still seen. When modifiedTime moves on without the bot,
+    someone edited the spreadsheet by hand: the rows are read again, compared a block at a
+    time by checksum, only the changed blocks are replaced and version goes up.
+    """
+    width = 7  # game, player, commander, first out, won, first blood and date
+    blockRows = 500
+
+    def __init__(self, spreadsheetID):
+        self.spreadsheetID = spreadsheetID
+        self.rows = []
+        self.checksums = []
+        self.modified = None  # Drive's modifiedTime when the copy last matched the sheet
+        self.checked = 0
+        self.version = 0  # goes up every time rows change without the bot writing them
+        self.changed = []  # (first row, last row) replaced by the last refresh
+
+    def modified_time(self):
+        return execute(google_client('drive').files().get(fileId=self.spreadsheetID, fields='modifiedTime'))['modifiedTime']
+
+    def fresh(self, maxAge):
+        """Whether the copy was checked against the sheet in the last maxAge seconds."""
+        return self.modified is not None and time.monotonic() - self.checked < maxAge
+
+    def sync(self, RawData, maxAge):
+        """Make sure the copy matches the sheet, looking at modifiedTime at most every maxAge seconds."""
+        if self.fresh(maxAge):
+            return
+        modified = self.modified_time()
+        self.checked = time.monotonic()
+        if modified != self.modified:
+            self.refresh(RawData.get_all_values())
+            self.modified = modified
+
+    def refresh(self, values):
+        rows = [(list(map(str, row)) + [''] * self.width)[:self.width] for row in values]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        checksums = self.block_checksums(rows)
+        self.changed = [(block * self.blockRows + 1, min(len(rows), (block + 1) * self.blockRows))
+                        for block in range(len(checksums))
+                        if block >= len(self.checksums) or checksums[block] != self.checksums[block]]
+        if self.changed or len(rows) != len(self.rows):
+            self.version += 1
+            print(f'RawData of {self.spreadsheetID} changed in rows {self.changed} . . .')
+        for first, last in self.changed:
+            self.rows[first - 1:last] = rows[first - 1:last]
+        del self.rows[len(rows):]
+        self.checksums = checksums
+
+    def block_checksums(self, rows, first=0):
+        return [hashlib.blake2b(json.dumps(rows[start:start + self.blockRows]).encode(), digest_size=16).digest()
+                for start in range(first * self.blockRows, len(rows), self.blockRows)]
+
+    def wrote(self, startRow, startColumn, values):
+        """Apply cells the bot just wrote, starting at a 1-based row and column."""
+        for i, row in enumerate(values):
+            while len(self.rows) < startRow + i:
+                self.rows.append([''] * self.width)
+            self.rows[startRow + i - 1][startColumn - 1:startColumn - 1 + len(row)] = map(str, row)
+        firstBlock = (startRow - 1) // self.blockRows
+        self.checksums[firstBlock:] = self.block_checksums(self.rows, firstBlock)
+
+    def saw_own_write(self):
+        """Take the modifiedTime after the bot's own write, so only other people's edits make the copy read again."""
+        if self.modified is not None:
+            self.modified = self.modified_time()
+            self.checked = time.monotonic()
+
+raw_data_mirrors = {}
+# how often the mirror asks Drive whether the spreadsheet was edited by hand
+raw_data_check_seconds = float(os.getenv('RawDataCheckSeconds', 30))
+
+def synced_mirror(spreadsheetID, maxAge=None):
+    """The spreadsheet's RawData mirror, loaded or brought up to date when it might be stale."""
+    mirror = raw_data_mirrors.setdefault(spreadsheetID, RawDataMirror(spreadsheetID))
+    mirror.sync(open_spreadsheet(spreadsheetID).rawData, raw_data_check_seconds if maxAge is None else maxAge)
+    return mirror
+
+class NameIndex:
+    """Trigram index of known names, so a typo is only compared against names that share part of it.
+
+    Names can also be looked up by prefix, or by an alias such as the part of a
+    commander's name before the comma.
+    """
+    candidates = 10
+
+    def __init__(self, names=()):
+        self.names = {}  # lowercase name -> name
+        self.aliases = {}  # lowercase alias -> name, None when two names share the alias
+        self.grams = {}  # trigram -> lowercase names and aliases that have it
+        self.ordered = []  # lowercase names in order, for prefix lookups
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return (self.names[key] for key in self.ordered)
+
+    @staticmethod
+    def trigrams(text):
+        padded = f'  {text} '
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, name):
+        key = name.lower()
+        if key in self.names:
+            return
+        self.names[key] = name
+        bisect.insort(self.ordered, key)
+        self.index_grams(key)
+
+        # 'Atraxa, praetors voice' can be entered as 'atraxa', partners by either half
+        aliases = {key.split(',')[0].strip()} | {half.strip() for half in key.split('//')}
+        for alias in aliases - {key, ''}:
+            self.add_alias(alias, name)
+
+    def add_alias(self, alias, name):
+        alias = alias.lower()
+        self.aliases[alias] = name if self.aliases.get(alias, name) == name else None
+        self.index_grams(alias)
+
+    def index_grams(self, key):
+        for gram in self.trigrams(key):
+            self.grams.setdefault(gram, set()).add(key)
+
+    def resolve(self, key):
+        return self.names.get(key) or self.aliases.get(key)
+
+    def prefix(self, text, limit=25):
+        """Known names starting with text, in alphabetical order."""
+        key = text.lower()
+        start = bisect.bisect_left(self.ordered, key)
+        matches = []
+        for lowered in self.ordered[start:start + limit]:
+            if not lowered.startswith(key):
+                break
+            matches.append(self.names[lowered])
+        return matches
+
+    def match(self, text, cutoff=0.4):
+        """The known name closest to text, or None when nothing is close enough."""
+        key = text.strip().lower()
+        if self.resolve(key):
+            return self.resolve(key)
+        if len(key) >= 3:
+            prefixed = self.prefix(key, limit=2)
+            if len(prefixed) == 1:
+                return prefixed[0]
+
+        # only the names sharing the most trigrams with text get the slower similarity check
+        shared = Counter()
+        for gram in self.trigrams(key):
+            shared.update(self.grams.get(gram, ()))
+        scored = [(SequenceMatcher(None, key, known).ratio(), known) for known, count in shared.most_common(self.candidates)
+                  if self.resolve(known)]
+        score, known = max(scored, default=(0, None))
+        return self.resolve(known) if score >= cutoff else None
+
+class Roster:
+    """A guild's Validations names, read from the sheet once and then kept up to date locally."""
+    columns = {'A': 0, 'D': 3}  # commanders are in column A and players in column D
+
+    def __init__(self, rows):
+        self.nextRow = {}
+        names = {}
+        for column, i in self.columns.items():
+            filled = [row[i].capitalize() for row in rows if len(row) > i and row[i] != '']
+            names[column] = filled[1:]  # remove column title
+            lastRow = max((r + 1 for r, row in enumerate(rows) if len(row) > i and row[i] != ''), default=0)
+            self.nextRow[column] = lastRow + 1
+        self.commanders = NameIndex(names['A'])
+        self.players = NameIndex(names['D'])
+        print('Grabbed player and commander names from spreadsheet . . .')
+
+    def index(self, column):
+        return self.commanders if column == 'A' else self.players
+
+    def reserve(self, column, count):
+        """Claim the next free rows of a column so two adds at once never write over each other."""
+        startRow = self.nextRow[column]
+        self.nextRow[column] += count
+        return startRow
+
+    def release(self, column, startRow, count):
+        # the rows can only be handed back when nothing was claimed after them
+        if self.nextRow[column] == startRow + count:
+            self.nextRow[column] = startRow
+
+rosters = {}
+roster_loads = {}
+
+async def load_roster(guildID):
+    try:
+        rosters[guildID] = Roster(await read_sheets(guildID, validation_values, active_sheets[str(guildID)]))
+    finally:
+        del roster_loads[guildID]
+
+def warm_roster(guildID):
+    """Start reading the guild's roster without waiting for it."""
+    if guildID not in rosters and guildID not in roster_loads and str(guildID) in active_sheets:
+        roster_loads[guildID] = asyncio.create_task(load_roster(guildID))
+        roster_loads[guildID].add_done_callback(report_roster_error)
+    return roster_loads.get(guildID)
+
+def report_roster_error(task):
+    if not task.cancelled() and task.exception():
+        print(f'could not read roster: {task.exception()!r}')
+
+async def guild_roster(guildID):
+    """The guild's roster, reading the Validations sheet only the first time it is asked for."""
+    if guildID not in rosters:
+        # every command waiting on the same guild shares one read
+        await asyncio.shield(warm_roster(guildID))
+    return rosters[guildID]
+
+async def add_roster_names(guildID, column, names):
+    """Write new names under the last ones in a Validations column and add them to the roster."""
+    roster = await guild_roster(guildID)
+    names = [name.capitalize() for name in names]
+    startRow = roster.reserve(column, len(names))
+    try:
+        await run_sheets(guildID, write_validation_names, active_sheets[str(guildID)], column, startRow, names)
+    except Exception:
+        roster.release(column, startRow, len(names))
+        raise
+    for name in names:
+        roster.index(column).add(name)
+
+def correct_name(inputNames, index):
     fixedNames = []
 
     for name in inputNames:
         name = name.capitalize()
-        matches = get_close_matches(word=name, possibilities=knownNames, n=1, cutoff=0.4)
+        match = index.match(name)
 
-        if matches:
-            fixedNames.append(matches[0])
+        if match:
+            fixedNames.append(match)
         else:
             fixedNames.append(name)
     return fixedNames
 
+# the spreadsheet every guild's stats start from, and how many shared copies of it to keep ready
+template_sheet_id = os.getenv('TemplateSheetID', '1uHT4HWD_x00-AVKbeot7h-2OVcPnJfu-9y2cERcVmxU')
+template_pool_size = int(os.getenv('TemplatePoolSize', 0))
+setup_attempts = int(os.getenv('SetupAttempts', 4))
+
+class SetupJobs:
+    """Each guild's /setup progress and the spare template copies, in SQLite so a retry or a restart carries on where it stopped.
+
+    Every guild's setup gets an idempotency key, which is also stamped on its copy of the
+    template, so a copy that went through before a failure is found instead of made again.
+    """
+    fields = ('key', 'channel', 'name', 'sheet', 'copying', 'shared', 'done', 'error')
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS setups (
+                               guild   INTEGER PRIMARY KEY,
+                               key     TEXT NOT NULL,
+                               channel INTEGER,
+                               name    TEXT,
+                               sheet   TEXT,
+                               copying INTEGER NOT NULL DEFAULT 0,
+                               shared  INTEGER NOT NULL DEFAULT 0,
+                               done    INTEGER NOT NULL DEFAULT 0,
+                               error   TEXT)''')
+        self.db.execute('CREATE TABLE IF NOT EXISTS spare_sheets (sheet TEXT PRIMARY KEY, created TEXT NOT NULL)')
+
+    def start(self, guildID, channelID, name):
+        """Begin a guild's setup, or pick its unfinished one back up under the same key."""
+        self.db.execute('''INSERT INTO setups (guild, key, channel, name) VALUES (?, ?, ?, ?)
+                           ON CONFLICT (guild) DO UPDATE SET channel = excluded.channel, name = excluded.name, error = NULL''',
+                        (guildID, uuid4().hex, channelID, name))
+
+    def get(self, guildID):
+        row = self.db.execute(f'SELECT {", ".join(self.fields)} FROM setups WHERE guild = ?', (guildID,)).fetchone()
+        return row and dict(zip(self.fields, row))
+
+    def update(self, guildID, **fields):
+        self.db.execute(f'UPDATE setups SET {", ".join(f"{field} = ?" for field in fields)} WHERE guild = ?', (*fields.values(), guildID))
+
+    def unfinished(self):
+        """Guilds of this process whose setup was still going when the bot stopped."""
+        owned, params = owned_guilds_sql('guild')
+        return [guild for guild, in self.db.execute(f'SELECT guild FROM setups WHERE NOT done AND error IS NULL AND {owned}', params)]
+
+    def add_spare(self, sheetID):
+        self.db.execute('INSERT OR IGNORE INTO spare_sheets (sheet, created) VALUES (?, ?)', (sheetID, datetime.now().isoformat()))
+
+    def take_spare(self):
+        """The oldest spare copy, gone from the pool so no other guild gets it, or None."""
+        row = self.db.execute('DELETE FROM spare_sheets WHERE sheet = (SELECT sheet FROM spare_sheets ORDER BY created LIMIT 1) RETURNING sheet').fetchone()
+        return row and row[0]
+
+    def spares(self):
+        return self.db.execute('SELECT COUNT(*) FROM spare_sheets').fetchone()[0]
+
+setup_jobs = SetupJobs(database_file)
+setup_tasks = {}
+template_pool_wakeup = asyncio.Event()
+template_pool_task = None
+
+def copy_template(name, key=None, retried=False):
+    """Copy the template spreadsheet, or when retried find the copy an earlier try with the same key already made."""
+    drive = google_client('drive')
+    if retried:
+        found = execute(drive.files().list(q=f"appProperties has {{ key='podstatsSetup' and value='{key}' }} and trashed = false",
+                                           fields='files(id)'))['files']
+        if found:
+            return found[0]['id']
+    body = {'name': name}
+    if key is not None:
+        body['appProperties'] = {'podstatsSetup': key}
+    return execute(drive.files().copy(fileId=template_sheet_id, body=body, fields='id'))['id']
+
+def share_spreadsheet(fileID):
+    """Let anyone with the link edit the spreadsheet."""
+    execute(google_client('drive').permissions().create(fileId=fileID, body={'type': 'anyone', 'role': 'writer'}))
+
+def name_spreadsheet(fileID, name):
+    execute(google_client('drive').files().update(fileId=fileID, body={'name': name}))
+
+async def run_setup(guildID, report):
+    """Copy, share and hand over a guild's spreadsheet, each step recorded so a retry starts from the one that failed."""
+    job = setup_jobs.get(guildID)
+    for attempt in range(setup_attempts):
+        try:
+            spare = False
+            if job['sheet'] is None:
+                job['sheet'] = setup_jobs.take_spare()
+                if job['sheet'] is not None:
+                    # spares are shared when they are made, only the name is left for after the link is sent
+                    spare = True
+                    setup_jobs.update(guildID, sheet=job['sheet'], shared=1)
+                    job['shared'] = 1
+                    template_pool_wakeup.set()
+                else:
+                    # a copy that was already asked for may have gone through, so then the key is looked up first,
+                    # and the flag is written before anything else can run
+                    retried = bool(job['copying'])
+                    setup_jobs.update(guildID, copying=1)
+                    job['copying'] = 1
+                    await report('Copying the stat tracking spreadsheet . . .')
+                    job['sheet'] = await run_sheets(guildID, copy_template, job['name'], job['key'], retried)
+                    setup_jobs.update(guildID, sheet=job['sheet'])
+                    print(f'copied empty Pod Stat spreadsheet for {guildID} . . .')
+            if not job['shared']:
+                await report('Sharing the spreadsheet . . .')
+                await run_sheets(guildID, share_spreadsheet, job['sheet'])
+                setup_jobs.update(guildID, shared=1)
+                job['shared'] = 1
+                print(f'sharing spreadsheet to guild {guildID}')
+
+            active_sheets[str(guildID)] = job['sheet']
+            setup_jobs.update(guildID, done=1)
+            await report(f'This channel has been set for the bot! use other slash (/) commands to use the bot\n'
+                         f"Here's the link: https://docs.google.com/spreadsheets/d/{job['sheet']}/edit\n"
+                         f'Open the link to start stat tracking!')
+            if spare:
+                await run_sheets(guildID, name_spreadsheet, job['sheet'], job['name'])
+            return
+        except Exception as error:
+            if attempt == setup_attempts - 1:
+                setup_jobs.update(guildID, error=repr(error))
+                print(f'setup failed for guild {guildID}: {error!r}')
+                await report('Could not make the spreadsheet, run /setup again to carry on from where it stopped.')
+                return
+            delay = 2 ** attempt * random.uniform(0.5, 1.5)
+            print(f'setup step failed for guild {guildID}, retrying in {delay:.1f}s: {error!r}')
+            await asyncio.sleep(delay)
+
+def start_setup(guildID, report=None):
+    """Run a guild's setup in the background, progress that cannot be reported (like to an expired interaction) only gets printed."""
+    said = set()
+
+    async def send(message):
+        # a retried step is not announced again
+        if message in said:
+            return
+        said.add(message)
+        if report is None:
+            print(f'setup of guild {guildID}: {message}')
+            return
+        try:
+            await report(message)
+        except discord.HTTPException as error:
+            print(f'could not report setup progress to guild {guildID}: {error!r}')
+
+    setup_tasks[guildID] = asyncio.create_task(run_setup(guildID, send))
+    return setup_tasks[guildID]
+
+def resume_setups():
+    """Carry on the setups a restart cut short, reporting in the channel they were started from."""
+    for guildID in setup_jobs.unfinished():
+        if guildID not in setup_tasks:
+            channel = bot.get_channel(setup_jobs.get(guildID)['channel'])
+            start_setup(guildID, channel.send if channel else None)
+
+async def fill_template_pool():
+    """Keep TemplatePoolSize shared copies of the template ready, so /setup only has to hand one over."""
+    while True:
+        try:
+            while setup_jobs.spares() < template_pool_size:
+                sheetID = await run_sheets(0, copy_template, 'Pod Stats (spare)')
+                await run_sheets(0, share_spreadsheet, sheetID)
+                setup_jobs.add_spare(sheetID)
+        except Exception as error:
+            print(f'could not fill the template pool: {error!r}')
+        template_pool_wakeup.clear()
+        try:
+            await asyncio.wait_for(template_pool_wakeup.wait(), timeout=300)
+        except asyncio.TimeoutError:
+            pass
+
 @bot.event
 async def on_guild_join(guild):
     # When the bot joins a new guild, send a 'hi' message to the first available text channel
@@ -256,60 +2092,29 @@ async def on_guild_join(guild):
             break
 
 @tree.command(name='setup', description='Sets up the bot to work in specific channel this command is used in.')
+@timed('setup')
 async def setup(interaction: discord.Interaction):
+    guildID = interaction.guild.id
+    if str(guildID) in active_sheets:
+        await interaction.response.send_message('setup has already been completed.')
+        return
+    if guildID in setup_tasks and not setup_tasks[guildID].done():
+        await interaction.response.send_message('setup is already running, the link will be posted here when the spreadsheet is ready.')
+        return
+
+    channels[str(guildID)] = interaction.channel.id
+    setup_jobs.start(guildID, interaction.channel.id, f'Pod Stats for: {interaction.guild.name}')
+    # the guild is claimed before the first await, so a /setup arriving meanwhile finds this one running
+    setup_tasks[guildID] = asyncio.get_running_loop().create_future()
     try:
-        if active_sheets[str(interaction.guild.id)]:
-            await interaction.response.send_message('setup has already been completed.')
-    except:
-        #copying sheet
-        def copy_spreadsheet():
-            copy_sheet = {
-                'name': f'Pod Stats for: {interaction.guild.name}',
-            }
-            response = drive_service.files().copy(
-                fileId= '1uHT4HWD_x00-AVKbeot7h-2OVcPnJfu-9y2cERcVmxU',
-                body=copy_sheet
-            ).execute()
-
-            return response
-
-        # Function to share the spreadsheet and generate a link
-        def share_spreadsheet(file_id):
-            # Set the file permissions to anyone with the link can view
-            permission = {
-                'type': 'anyone',
-                'role': 'writer'
-            }
-            drive_service.permissions().create(
-                fileId=file_id,
-                body=permission
-            ).execute()
-
-            # Generate the link
-            link = f"https://docs.google.com/spreadsheets/d/{file_id}/edit"
-            return link
-
-        channels[str(interaction.guild.id)] = interaction.channel.id
-        save_channels(channels)
         await interaction.response.send_message(f'This channel has been set for the bot! use other slash (/) commands to use the bot\n'
                                                 f'Making a stat tracking spreadsheet. . .')
-
-        print('copying empty Pod Stat spreadsheet . . .')
-        copiedFile = copy_spreadsheet()
-        print('copied empty Pod Stat spreadsheet . . .')
-        copiedFileID = copiedFile['id']
-
-        active_sheets[str(interaction.guild.id)] = copiedFileID
-        save_active_stats(active_sheets)
-
-        link = share_spreadsheet(copiedFileID)
-        print(f'sharing spreadsheet to {interaction.guild.name}')
-
-        await interaction.followup.send(f'This channel has been set for the bot! use other slash (/) commands to use the bot\n'
-                                                f"Here's the link: {link}\n"
-                                                f'Open the link to start stat tracking!')
+    finally:
+        # the job is recorded either way, so it runs even if the first message could not be sent
+        start_setup(guildID, interaction.followup.send)
 
 @tree.command(name= 'link', description= 'Sends a link for the google spreadsheet that is being used.')
+@timed('link')
 async def send_link(interaction: discord.Interaction):
     if is_correct_channel(interaction):
         await interaction.response.send_message(f'https://docs.google.com/spreadsheets/d/{active_sheets[str(interaction.guild.id)]}/?usp=sharing')
@@ -318,6 +2123,7 @@ async def send_link(interaction: discord.Interaction):
         await interaction.response.send_message('This command must be run in the designated channel.')
 
 @tree.command(name='addplayers', description= 'Adds players to the spreadsheet.')
+@timed('addplayers')
 async def addplayers(interaction: discord.Interaction):
     if is_correct_channel(interaction):
         await interaction.response.send_message('Send the name of the player(s) you want to add to the spreadsheet\n'
@@ -334,16 +2140,7 @@ async def addplayers(interaction: discord.Interaction):
             else:
                 player = players.split(', ') if ', ' in players else players.split(',')
 
-                Title, Tables, RawData, Validations = get_sheets(active_sheets[str(interaction.guild.id)])
-                spreadsheet = client.open(Title)
-                Valid = spreadsheet.worksheet(title=Validations)
-                playerCol = Valid.col_values(4)  # Get all values in the column
-
-
-                # Update the column in Google Sheets
-                update_range = f"D{len(playerCol) + 1}:D{len(playerCol) + len(player)}"
-                update_data = [[play.capitalize()] for play in player]
-                Valid.update(update_data, update_range)
+                await add_roster_names(interaction.guild.id, 'D', player)
 
                 print(f'Added {len(player)} player(s) to spreadsheet {interaction.guild.name}')
 
@@ -353,6 +2150,7 @@ async def addplayers(interaction: discord.Interaction):
             await interaction.followup.send('You took too long to reply!')
 
 @tree.command(name='addcommanders', description= 'Adds commanders to the spreadsheet.')
+@timed('addcommanders')
 async def addcommanders(interaction: discord.Interaction):
     if is_correct_channel(interaction):
         await interaction.response.send_message('Send the name of the commander(s) you want to add to the spreadsheet\n'
@@ -369,15 +2167,7 @@ async def addcommanders(interaction: discord.Interaction):
             else:
                 commander = commanders.split(' | ') if ' | ' in commanders else commanders.split('|')
 
-                Title, Tables, RawData, Validations = get_sheets(active_sheets[str(interaction.guild.id)])
-                spreadsheet = client.open(Title)
-                Valid = spreadsheet.worksheet(title=Validations)
-                commanderCol = Valid.col_values(1)  # Get all values in the column
-
-                # Update the column in Google Sheets
-                update_range = f"A{len(commanderCol) + 1}:A{len(commanderCol) + len(commander)}"
-                update_data = [[play.capitalize()] for play in commander]
-                Valid.update(update_data, update_range)
+                await add_roster_names(interaction.guild.id, 'A', commander)
 
                 print(f'Added {len(commander)} commander(s) to spreadsheet {interaction.guild.name}')
 
@@ -385,202 +2175,428 @@ async def addcommanders(interaction: discord.Interaction):
         except asyncio.TimeoutError:
             await interaction.followup.send('You took too long to reply!')
 
-@tree.command(name='addgame', description='Add a game to the spreadsheet, will ask for players and commanders.')
-async def addGame(interaction: discord.Interaction):
-    if is_active_game(interaction):
-        await interaction.response.send_message('Use /finishgame to put in the results of previous game before starting a new game!')
-    elif is_correct_channel(interaction) and not is_active_game(interaction):
+async def player_autocomplete(interaction: discord.Interaction, current: str):
+    with metrics.span('autocomplete', field='player'):
+        return roster_choices(interaction.guild.id, 'D', current)
+
+async def commander_autocomplete(interaction: discord.Interaction, current: str):
+    with metrics.span('autocomplete', field='commander'):
+        return roster_choices(interaction.guild.id, 'A', current)
+
+def roster_choices(guildID, column, current):
+    """Names starting with what has been typed so far, straight from the in-memory roster."""
+    if guildID not in rosters:
+        # autocomplete has to answer right away, so the names will be there on the next key press
+        warm_roster(guildID)
+        return []
+    index = rosters[guildID].index(column)
+    names = index.prefix(current)
+    if not names and current:
+        match = index.match(current)
+        names = [match] if match else []
+    return [app_commands.Choice(name=name, value=name) for name in names]
+
+seats = range(1, 6)  # a row of finish buttons per player, and discord allows 5 rows
+
+@tree.command(name='addgame', description='Add a game to the spreadsheet, pick each player and the commander they played.')
+@app_commands.describe(**{f'player{seat}': f'player in seat {seat}' for seat in seats},
+                       **{f'commander{seat}': f'commander played by player {seat}' for seat in seats})
+@app_commands.autocomplete(**{f'player{seat}': player_autocomplete for seat in seats},
+                           **{f'commander{seat}': commander_autocomplete for seat in seats})
+@timed('addgame')
+async def addGame(interaction: discord.Interaction, player1: str, commander1: str, player2: str, commander2: str,
+                  player3: str = None, commander3: str = None, player4: str = None, commander4: str = None,
+                  player5: str = None, commander5: str = None):
+    if is_correct_channel(interaction):
         sheetID = active_sheets[str(interaction.guild.id)]
+        pairs = [(player1, commander1), (player2, commander2), (player3, commander3), (player4, commander4), (player5, commander5)]
+
+        if any(bool(play) != bool(comm) for play, comm in pairs):
+            await interaction.response.send_message('Every player needs a commander!')
+            return
+        pairs = [(play, comm) for play, comm in pairs if play]
 
-        Title, Tables, RawData, Validations = get_sheets(sheetID)
-        spreadsheet = client.open(Title)
-        allPlayers, allCommanders = data_refresh(spreadsheet.worksheet(title=Validations))
+        if interaction.guild.id not in rosters:
+            # reading the spreadsheet can take longer than the 3 seconds discord gives to respond
+            await interaction.response.defer()
+        roster = await guild_roster(interaction.guild.id)
+        send = interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
 
-        if allPlayers == [] or allCommanders == []:
-            await interaction.response.send_message('Please add some players and commanders first!')
+        if len(roster.players) == 0 or len(roster.commanders) == 0:
+            await send('Please add some players and commanders first!')
             print('No players or commanders grabbed . . .')
         else:
+            #checks to see if theres a typo in anything not picked from autocomplete and corrects it
+            player = correct_name([play for play, comm in pairs], roster.players)
+            commander = correct_name([comm for play, comm in pairs], roster.commanders)
+
+            # checked after the typo fixes, which can turn two names into the same player
+            seated = [play.capitalize() for play in player]
+            twice = sorted({play for play in seated if seated.count(play) > 1})
+            if twice:
+                await send(f'{", ".join(twice)} can only be in one seat of a game!')
+                return
+
+            # a player can only sit at one table at a time
+            busy = [(play, gameID) for gameID, game in active_games.get(interaction.guild.id, {}).items()
+                    for play in player if play in game['players']]
+            if busy:
+                await send('\n'.join(f'{play} is still in game {gameID}, use /finishgame to put in its results first!' for play, gameID in busy))
+                return
+
+            #joins player and commander together
+            playerAndCommander = [(f'{play} playing {comm}') for play, comm in zip(player, commander)]
+
+            #joining the players and commanders to make the message in discord look nice
+            gameInfo = '\n'.join(playerAndCommander)
+            print(f'Adding game in {interaction.guild.name} to spreadsheet {sheetID}. . .')
+
+            #saving the game locally, the flusher sends it to the google sheet
+            game = record_game(interaction.guild.id, player, commander)
+            print(game)
+
+            await send(f'Adding game {game["id"]} to spreadsheet.\n'
+                       f'--------------------------\n'
+                       f'{gameInfo}\n'
+                       f'--------------------------\n'
+                       f'Use /finishgame once it is over!')
+    else:
+        await interaction.response.send_message('This command must be run in the designated channel.')
 
-            allPlayers    = '\n'.join(allPlayers)
-            allCommanders = '\n'.join(allCommanders)
-
-            await interaction.response.send_message(f'Please choose players:\n'
-                                                    f'{allPlayers}\n'
-                                                    f'Send a message with player names followed by a comma:')
-
-            def check(m):
-                return m.author == interaction.user and m.channel == interaction.channel
+def describe_game(game):
+    return f'{game["id"]}: {", ".join(game["players"])}'
 
-            try:
-                players = await bot.wait_for('message', check=check, timeout=60.0)
-                players = players.content
+def find_active_game(guildID, asked):
+    """The active game with the ID asked for, or the only one a player asked for is in."""
+    games = active_games.get(guildID, {})
+    if asked in games:
+        return games[asked]
+    seated = [game for game in games.values() if asked.lower() in (player.lower() for player in game['players'])]
+    return seated[0] if len(seated) == 1 else None
 
-                if players.lower() == 'cancel':
-                    await interaction.followup.send('Canceling . . .')
-                else:
-                    await interaction.followup.send(f'You selected: {players}\n'
-                                                    f'\n'
-                                                    f'Please choose commanders:\n'
-                                                    f'{allCommanders}\n'
-                                                    f'Send a message with commander names followed by a pipe ( | ):')
-
-                    commanders = await bot.wait_for('message', check=check, timeout=60.0)
-                    commanders = commanders.content
-                    if commanders.lower() == 'cancel':
-                        await interaction.followup.send('Canceling . . .')
-                    else:
-                        #putting players to commanders
-                        player = players.split(', ') if ', ' in players else players.split(',')
-                        commander = commanders.split(' | ') if ' | ' in commanders else commanders.split('|')
-
-                        #after split, checks to see if theres a typo and corrects it
-                        player = correct_name(player, allPlayers.split('\n'))
-                        commander = correct_name(commander, allCommanders.split('\n'))
-
-                        #joins player and commander together
-                        playerAndCommander = [(f'{play} playing {comm}') for play, comm in zip(player, commander)]
-
-                        #joining the players and commanders to make the message in discord look nice
-                        gameInfo = '\n'.join(playerAndCommander)
-                        await interaction.followup.send(f'You selected: {commanders}\n'
-                                                        f'--------------------------\n'
-                                                        f'{gameInfo}\n'
-                                                        f'--------------------------\n'
-                                                        f'Are both players and commanders correct?')
-                        correct = await bot.wait_for('message', check=check, timeout=30.0)
-
-                        if correct.content.lower().startswith('n'):
-                            await interaction.followup.send('Ending transaction. Restart the command.')
-                            print('Restarted input . . .')
-                        elif correct.content.lower().startswith('y'):
-                            await interaction.followup.send('Adding game to spreadsheet.')
-                            print(f'Adding game in {interaction.guild.name} to spreadsheet {sheetID}. . .')
-
-                            #sending data to google sheet
-                            game_to_sheet(player, commander, spreadsheet.worksheet(title=RawData))
-                            active_game[interaction.guild.id] = (player, commander)
-                            print(active_game[interaction.guild.id])
-
-            except asyncio.TimeoutError:
-                await interaction.followup.send('You took too long to reply!')
-    else:
-        await interaction.response.send_message('This command must be run in the designated channel.')
+async def game_autocomplete(interaction: discord.Interaction, current: str):
+    with metrics.span('autocomplete', field='game'):
+        games = active_games.get(interaction.guild.id, {}).values()
+        return [app_commands.Choice(name=describe_game(game)[:100], value=game['id'])
+                for game in games if current.lower() in describe_game(game).lower()][:25]
 
 @tree.command(name='finishgame', description='Finish a game by marking if a player died first, won the game and, got first blood (killed first).')
-async def finishGame(interaction: discord.Interaction):
+@app_commands.describe(game='the game to finish, or a player in it, when more than one is going')
+@app_commands.autocomplete(game=game_autocomplete)
+@timed('finishgame')
+async def finishGame(interaction: discord.Interaction, game: str = None):
     if is_correct_channel(interaction):
-        if interaction.guild.id not in active_game:
+        games = active_games.get(interaction.guild.id, {})
+        if not games:
             await interaction.response.send_message('No active game found.')
-
-        players, commanders = active_game[interaction.guild.id]
-        view = MyView(players, commanders)
-        await interaction.response.send_message('Here are your buttons:', view=view)
+            return
+        if game is not None:
+            found = find_active_game(interaction.guild.id, game)
+            if found is None:
+                await interaction.response.send_message(f'No active game matches {game}, the games going are:\n'
+                                                        + '\n'.join(describe_game(going) for going in games.values()))
+                return
+        elif len(games) == 1:
+            found = next(iter(games.values()))
+        else:
+            await interaction.response.send_message(f'There are {len(games)} games going, pick one with the game option:\n'
+                                                    + '\n'.join(describe_game(going) for going in games.values()))
+            return
+        picks = journal.picks(found['id'])
+        if len(picks) == len(finish_stats):
+            # every button was pressed but the finish never went through, so it goes through now
+            record_finish(interaction.guild.id, found['id'], [picks[0], picks[1], picks[2]])
+            print(f'finishing game {found["id"]} . . .')
+            await interaction.response.send_message(f'Everything was already picked for game {describe_game(found)}, finishing game!')
+            return
+        view = MyView(found, picks)
+        await interaction.response.send_message(f'Here are your buttons for game {describe_game(found)}', view=view)
     else:
         await interaction.response.send_message('This command must be run in the designated channel.')
 
 @tree.command(name='tableplayer', description='Display the table for player stats.')
+@timed('tableplayer')
 async def playerTable(interaction: discord.Interaction):
     if is_correct_channel(interaction):
         #await interaction.response.send_message('Printing player table. . .')
         sheetID = active_sheets[str(interaction.guild.id)]
 
-        Title, Tables, RawData, Validations = get_sheets(sheetID)
-        spreadsheet = client.open(Title)
-
-        tablesSheet = spreadsheet.worksheet(title=Tables)
-        tableData = tablesSheet.get_all_values()
-
-        playerNumber = tablesSheet.col_values(2)  # Get all values in the column
-        lastPlayer = len(playerNumber)  # The last filled row is the length of the list
-
-        players = pd.DataFrame(tableData)
-
-        table1 = players.iloc[:lastPlayer]
-        table1 = table1.iloc[1:, 1:8]
-        table1_list = [table1.columns.tolist()] + table1.values.tolist()
-
-        # Determine the maximum width for each column
-        col_widths = [max(len(str(item)) for item in col) for col in zip(*table1_list)]
-
-        # Create a formatted string for each row
-        formatted_table = []
-
         # Send an initial response to acknowledge the interaction
         await interaction.response.defer()
 
-        # Send a follow-up message to which you will make edits
-        message = await interaction.followup.send("Starting to build the table...\n``` \n")
-
-        # Assume table1_list is prepared, and col_widths calculated as before
-        formatted_table = []
-
-        for row in table1_list:
-            formatted_row = " | ".join(f"{str(item):<{col_widths[i]}}" for i, item in enumerate(row))
-            formatted_table.append(formatted_row)
-
-            # Update the message with the current progress
-            current_table = "\n".join(formatted_table)
-            await message.edit(content=f"```\n{current_table}\n```")
-
-            # Optional delay to simulate real-time updates
-            await asyncio.sleep(0.5)  # Adjust the delay as needed
-
-        # Finalize the message
-        await message.edit(content=f"```\n{current_table}\n```")
+        stats = await guild_stats(interaction.guild.id)
+        await send_table(interaction, stats.player_table(), 'players')
+        print(f'sent player table for {sheetID}')
 
 @tree.command(name='tablecommander', description='Display the table for commander stats.')
+@timed('tablecommander')
 async def commanderTable(interaction: discord.Interaction):
     if is_correct_channel(interaction):
         #await interaction.response.send_message('Printing player table. . .')
         sheetID = active_sheets[str(interaction.guild.id)]
 
-        Title, Tables, RawData, Validations = get_sheets(sheetID)
-        spreadsheet = client.open(Title)
-
-        tablesSheet = spreadsheet.worksheet(title=Tables)
-        tableData = tablesSheet.get_all_values()
-
-        commanderNumber = tablesSheet.col_values(12)  # Get all values in the column
-        lastPlayer = len(commanderNumber)  # The last filled row is the length of the list
-
-        commanders = pd.DataFrame(tableData)
-
-        table2 = commanders.iloc[:lastPlayer]
-        table2 = table2.iloc[1:, 11:20]
-        table2_list = [table2.columns.tolist()] + table2.values.tolist()
-
-        # Determine the maximum width for each column
-        col_widths = [max(len(str(item)) for item in col) for col in zip(*table2_list)]
-
         # Send an initial response to acknowledge the interaction
         await interaction.response.defer()
 
-        # Send a follow-up message to which you will make edits
-        message = await interaction.followup.send("Starting to build the table...\n``` \n")
-        print(f'starting commanbder table for {sheetID} . . .')
-
-        # Assume table1_list is prepared, and col_widths calculated as before
-        formatted_table = []
-
-        for row in table2_list:
-            formatted_row = " | ".join(f"{str(item):<{col_widths[i]}}" for i, item in enumerate(row))
-            formatted_table.append(formatted_row)
-
-            # Update the message with the current progress
-            current_table = "\n".join(formatted_table)
-            await message.edit(content=f"```\n{current_table}\n```")
-
-            # Optional delay to simulate real-time updates
-            await asyncio.sleep(0.5)  # Adjust the delay as needed
-
-        # Finalize the message
-        await message.edit(content=f"```\n{current_table}\n```")
-        print(f'finished commanbder table for {sheetID}')
+        stats = await guild_stats(interaction.guild.id)
+        await send_table(interaction, stats.commander_table(), 'commanders')
+        print(f'sent commander table for {sheetID}')
+
+async def kind_autocomplete(interaction: discord.Interaction, current: str):
+    """Players, or commanders when the command's kind option says so."""
+    with metrics.span('autocomplete', field='kind'):
+        return roster_choices(interaction.guild.id, 'A' if interaction.namespace.kind == 'commanders' else 'D', current)
+
+@tree.command(name='ratings', description='Elo ratings of the players or commanders, or where one of them ranks.')
+@app_commands.describe(kind='rate players or commanders', name='a player or commander to look up instead of the whole leaderboard')
+@app_commands.autocomplete(name=kind_autocomplete)
+@timed('ratings')
+async def showRatings(interaction: discord.Interaction, kind: Literal['players', 'commanders'] = 'players', name: str = None):
+    if not is_correct_channel(interaction):
+        await interaction.response.send_message('This command must be run in the designated channel.')
+        return
+    await interaction.response.defer()
+    await guild_ratings(interaction.guild.id)
+    leaderboard = ratings.leaderboard(interaction.guild.id, kind[:-1])
+    if not leaderboard:
+        await interaction.followup.send(f'No {kind} have finished a game yet.')
+    elif name:
+        found = NameIndex(rated for rated, rating, games in leaderboard).match(name.capitalize())
+        if found is None:
+            await interaction.followup.send(f'No {kind[:-1]} called {name} has finished a game yet.')
+        else:
+            rank, (rated, rating, games) = next((rank, row) for rank, row in enumerate(leaderboard, start=1) if row[0] == found)
+            await interaction.followup.send(f'{rated} is rated {rating:.0f} after {games} game(s), {rank} of {len(leaderboard)} {kind}.')
+    else:
+        rows = [['Rank', Ratings.kinds[kind[:-1]], 'Rating', 'Games']]
+        rows += [[rank, rated, round(rating), games] for rank, (rated, rating, games) in enumerate(leaderboard, start=1)]
+        await send_table(interaction, rows, f'{kind}-ratings')
+
+@tree.command(name='matchup', description='Head to head record of two players, or two commanders, in the games they played together.')
+@app_commands.describe(first='a player or commander', second='who to compare them with', kind='compare players or commanders')
+@app_commands.autocomplete(first=kind_autocomplete, second=kind_autocomplete)
+@timed('matchup')
+async def matchup(interaction: discord.Interaction, first: str, second: str, kind: Literal['players', 'commanders'] = 'players'):
+    if not is_correct_channel(interaction):
+        await interaction.response.send_message('This command must be run in the designated channel.')
+        return
+    await interaction.response.defer()
+    counted = await guild_matchups(interaction.guild.id)
+    names = [counted.match(kind[:-1], name) for name in (first, second)]
+    for name, found in zip((first, second), names):
+        if found is None:
+            await interaction.followup.send(f'No {kind[:-1]} called {name} has finished a game yet.')
+            return
+    first, second = names
+    if first == second:
+        await interaction.followup.send(f'Pick two different {kind}.')
+        return
+
+    together, firstWins, secondWins = counted.head_to_head(kind[:-1], first, second)
+    if not together:
+        await interaction.followup.send(f'{first} and {second} have not finished a game together yet.')
+        return
+    await interaction.followup.send(f'{first} and {second} played {together} game(s) together. {first} won {firstWins} ({firstWins / together:.0%}), '
+                                    f'{second} won {secondWins} ({secondWins / together:.0%}) and someone else won {together - firstWins - secondWins}.')
+
+@tree.command(name='commanderstats', description='Record of a commander overall, by seat and against every other commander.')
+@app_commands.describe(name='the commander to look up')
+@app_commands.autocomplete(name=commander_autocomplete)
+@timed('commanderstats')
+async def commanderStats(interaction: discord.Interaction, name: str):
+    if not is_correct_channel(interaction):
+        await interaction.response.send_message('This command must be run in the designated channel.')
+        return
+    await interaction.response.defer()
+    counted = await guild_matchups(interaction.guild.id)
+    found = counted.match('commander', name)
+    if found is None:
+        await interaction.followup.send(f'No commander called {name} has finished a game yet.')
+        return
+
+    games, wins, firstOut, firstBlood = counted.totals['commander'][found]
+    pilots = sorted(counted.pilots[found].items(), key=lambda pilot: (-pilot[1][0], -pilot[1][1], pilot[0]))[:3]
+    seatLines = '\n'.join(format_table(counted.seat_table('commander', found)))
+    await interaction.followup.send(f'{found} has played {games} game(s), won {wins} ({wins / games:.0%}), gone out first {firstOut} time(s) '
+                                    f'and drawn first blood {firstBlood} time(s). Played most by '
+                                    + ', '.join(f'{player} ({played} game(s), {won} win(s))' for player, (played, won) in pilots)
+                                    + f'.\n```\n{seatLines}\n```')
+    await send_table(interaction, counted.opponent_table('commander', found, 'Against'), 'commander-matchups')
+
+@tree.command(name='chart', description='Draw how win rates changed over time, or which commanders get played each month.')
+@app_commands.describe(chart='winrate for the players\' win rates over time, popularity for commanders played per month')
+@timed('chart')
+async def showChart(interaction: discord.Interaction, chart: Literal['winrate', 'popularity'] = 'winrate'):
+    if not is_correct_channel(interaction):
+        await interaction.response.send_message('This command must be run in the designated channel.')
+        return
+    await interaction.response.defer()
+    try:
+        image = await guild_chart(interaction.guild.id, chart)
+    except ImportError:
+        await interaction.followup.send('Charts need matplotlib installed where the bot runs.')
+        return
+    await interaction.followup.send(file=discord.File(io.BytesIO(image), filename=f'{chart}.png'))
+
+@tree.command(name='importgames', description='Add games from a CSV file with the same columns as the RawData sheet.')
+@app_commands.describe(file='CSV of game, player, commander, first out, won, first blood and date, a row per player')
+@timed('importgames')
+async def importGames(interaction: discord.Interaction, file: discord.Attachment):
+    if not is_correct_channel(interaction):
+        await interaction.response.send_message('This command must be run in the designated channel.')
+        return
+    await interaction.response.defer()
+    guildID = interaction.guild.id
+    sheetID = active_sheets[str(guildID)]
+    reader = GameImport(await guild_roster(guildID))
+    games, imported, appends = [], 0, 0
+    start = time.perf_counter()
+
+    async def write(games):
+        nonlocal imported, appends
+        if games:
+            await run_sheets(guildID, import_games, sheetID, games)
+            await note_own_write(guildID, sheetID)
+            imported += len(games)
+            appends += 1
+
+    failure = None
+    try:
+        # the file is read a line at a time and written a chunk of rows at a time, never held whole
+        async with aiohttp.ClientSession() as session:
+            async with session.get(file.url) as response:
+                response.raise_for_status()
+                lines = []
+                async for line in response.content:
+                    lines.append(line.decode('utf-8'))
+                    if len(lines) == 1000:
+                        games += reader.feed(lines)
+                        lines = []
+                        if sum(len(game['players']) for game in games) >= import_chunk_rows:
+                            await write(games)
+                            games = []
+                games += reader.feed(lines) + reader.close()
+        await write(games)
+    except (aiohttp.ClientError, UnicodeDecodeError, csv.Error) as error:
+        failure = f'Could not read {file.filename} ({error})'
+    except (gspread.exceptions.APIError, requests.RequestException) as error:
+        failure = f'Google would not take the games ({error})'
+    except Exception:
+        await interaction.followup.send(f'Something went wrong importing {file.filename}, {imported} game(s) were imported before that.')
+        raise
+    finally:
+        # the tables are read again with the new games in them
+        stats_engines.pop(guildID, None)
+        matchups.pop(guildID, None)
+        ratings_versions.pop(guildID, None)
+        for drawn in charts.chart_drawings:
+            chart_images.pop((guildID, drawn), None)
+
+    if failure:
+        await interaction.followup.send(f'{failure}, {imported} game(s) were imported before that.')
+    # the names read so far are still added when the import stopped partway
+    for column, names in (('D', reader.newNames['D']), ('A', reader.newNames['A'])):
+        if names:
+            await add_roster_names(guildID, column, sorted(names))
+    if failure:
+        return
+    print(f'imported {imported} game(s) into {sheetID} with {appends} append(s) in {time.perf_counter() - start:.1f}s')
+
+    message = [f'Imported {imported} game(s) from {file.filename}.']
+    if reader.skipped:
+        message.append(f'Skipped {len(reader.skipped)} game(s):')
+        message.extend(f'line {line}: {why}' for line, why in reader.skipped[:10])
+        if len(reader.skipped) > 10:
+            message.append(f'. . . and {len(reader.skipped) - 10} more')
+    for column, kind in (('D', 'player'), ('A', 'commander')):
+        if reader.newNames[column]:
+            message.append(f'New {kind}(s) added to the spreadsheet: {", ".join(sorted(reader.newNames[column]))}'[:300])
+    await interaction.followup.send('\n'.join(message))
+
+@tree.command(name='exportgames', description='Download every game in the spreadsheet as a CSV or Parquet file.')
+@app_commands.describe(filetype='csv, or parquet for pandas and other data tools')
+@timed('exportgames')
+async def exportGames(interaction: discord.Interaction, filetype: Literal['csv', 'parquet'] = 'csv'):
+    if not is_correct_channel(interaction):
+        await interaction.response.send_message('This command must be run in the designated channel.')
+        return
+    await interaction.response.defer()
+    try:
+        # not read_sheets, two exports sharing one file would close it on each other
+        exported, count = await run_sheets(interaction.guild.id, export_raw_data, active_sheets[str(interaction.guild.id)], filetype)
+    except ImportError:
+        await interaction.followup.send('Parquet exports need pyarrow installed where the bot runs, try csv instead.')
+        return
+    with exported:
+        exported.seek(0, io.SEEK_END)
+        if exported.tell() > interaction.guild.filesize_limit:
+            await interaction.followup.send('The export is bigger than this server lets me upload, the spreadsheet has everything too.')
+            return
+        exported.seek(0)
+        await interaction.followup.send(f'{count} game row(s), games still syncing to the spreadsheet are not in it yet.',
+                                        file=discord.File(exported, filename=f'podstats-games.{filetype}'))
+
+@tree.command(name='botstats', description='Show how long commands, Google and Discord requests have been taking (admins only).')
+@app_commands.default_permissions(administrator=True)
+@timed('botstats')
+async def botStats(interaction: discord.Interaction):
+    if not interaction.permissions.administrator:
+        await interaction.response.send_message('Only server admins can see the bot stats.', ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+
+    rows = [['metric', 'calls', 'errors', 'p50 ms', 'p99 ms', 'max ms']] + metrics.summary()
+    scheduler = google_scheduler.metrics()
+    rows.append(['google requests queued', scheduler['queued'], '', '', '', ''])
+    rows.append(['google requests waiting for quota', scheduler['waiting'], '', '', '', ''])
+    rows.append(['games waiting to sync', len(journal.pending()), '', '', '', ''])
+    for name, count in sorted(metrics.guild_counts(interaction.guild.id).items()):
+        rows.append([f'this server: {name}', count, '', '', '', ''])
+    await send_table(interaction, rows, 'botstats', ephemeral=True)
+
+metrics.gauge('google_queued', lambda: google_scheduler.queued)
+metrics.gauge('google_waiting', lambda: google_scheduler.waiting)
+metrics.gauge('google_quota_wait_seconds', lambda: google_scheduler.metrics()['wait_seconds'], label='kind')
+metrics.gauge('journal_pending', lambda: len(journal.pending()))
+metrics.gauge('active_games', lambda: sum(len(games) for games in active_games.values()))
+metrics.gauge('cached_spreadsheets', lambda: len(sheet_cache))
+metrics.gauge('loaded_rosters', lambda: len(rosters))
+metrics.gauge('cached_matchups', lambda: len(matchups))
+metrics.gauge('cached_charts', lambda: len(chart_images))
+metrics.gauge('spare_sheets', lambda: setup_jobs.spares())
+
+def command_tree_hash():
+    """A hash of every slash command as discord sees it, to tell whether the commands changed since the last sync."""
+    commands = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda command: command['name'])
+    return hashlib.sha256(json.dumps([bot.application_id, commands], sort_keys=True).encode()).hexdigest()
 
 @bot.event
 async def on_ready():
-    await tree.sync()
+    global flusher_task, template_pool_task
+    if flusher_task is None:
+        flusher_task = asyncio.create_task(journal_flusher())
+        # import pandas in the background so the first table does not wait for it
+        asyncio.get_running_loop().run_in_executor(None, importlib.import_module, 'pandas')
+    if not metrics_tasks:
+        metrics_tasks.append(asyncio.create_task(watch_event_loop()))
+        if metrics_port:
+            await serve_metrics(metrics_host, metrics_port)
+    if template_pool_size and template_pool_task is None and owns_guild(0):
+        template_pool_task = asyncio.create_task(fill_template_pool())
+    resume_setups()
+    # finish buttons sent before a restart are matched by their custom_id
+    bot.add_dynamic_items(FinishButton)
+    # on_ready runs again after every reconnect, discord only needs the commands when they change,
+    # and only from the process running shard 0
+    treeHash = command_tree_hash()
+    if owns_guild(0) and config.get_meta('command_tree_hash') != treeHash:
+        await tree.sync()
+        config.set_meta('command_tree_hash', treeHash)
+        print('synced slash commands . . .')
     print(f'We have logged in as {bot.user}')
 
 if __name__ == '__main__':
-    bot.run(discord_key)
\ No newline at end of file
+    if shard_processes > 1 and shard_ids is None:
+        launch_shards(shard_processes)
+    else:
+        bot.run(discord_key)
\ No newline at end of file
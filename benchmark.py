@@ -0,0 +1,650 @@
+"""Benchmarks for the bot that run without Google or Discord accounts.
+
+Google and Discord are replaced by in-process fakes that sleep for a set latency
+on every call and count them, so a run shows what each command costs:
+
+    python benchmark.py matcher
+    python benchmark.py commands --guilds 50 --games 3 --latency 0.08
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import random
+import re
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from difflib import get_close_matches
+from unittest import mock
+
+import gspread.utils
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeGoogle:
+    """What every fake Google object shares: the latency of a call and how many calls each spreadsheet got."""
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = Counter()
+        self.hooks = []
+        self.lock = threading.Lock()
+        self.spreadsheets = {}
+        self.template = None
+        self.copies = 0
+        self.bot = None
+
+    def count(self, key):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls[key] += 1
+        for hook in self.hooks:
+            hook(None)
+
+    def call(self, key, kind, work, endpoint=None, idempotent=True):
+        """A gspread call, which in the bot would go through ScheduledHTTPClient."""
+        def send():
+            self.count(key)
+            return work()
+        return self.bot.google_scheduler.call(kind, send, endpoint=endpoint, idempotent=idempotent)
+
+
+class FakeWorksheet:
+    """The parts of gspread's Worksheet the bot uses, on a list of rows."""
+    def __init__(self, google, key, title, rows=None):
+        self.google = google
+        self.key = key
+        self.title = title
+        self.rows = rows or []
+
+    def read(self, call, work):
+        return self.google.call(self.key, 'sheets_read', work, endpoint=f'{call} {self.title}')
+
+    def write(self, call, work, idempotent=True):
+        def edit():
+            self.google.spreadsheets[self.key].modified = time.time()
+            return work()
+        return self.google.call(self.key, 'sheets_write', edit, endpoint=f'{call} {self.title}', idempotent=idempotent)
+
+    def set_values(self, a1, values):
+        startRow, startCol = gspread.utils.a1_to_rowcol(a1.split('!')[-1].split(':')[0])
+        for i, valueRow in enumerate(values):
+            while len(self.rows) < startRow + i:
+                self.rows.append([])
+            row = self.rows[startRow + i - 1]
+            while len(row) < startCol + len(valueRow) - 1:
+                row.append('')
+            row[startCol - 1:startCol - 1 + len(valueRow)] = valueRow
+        endCell = gspread.utils.rowcol_to_a1(startRow + len(values) - 1, startCol + max(map(len, values)) - 1)
+        return f"'{self.title}'!{gspread.utils.rowcol_to_a1(startRow, startCol)}:{endCell}"
+
+    def last_row(self):
+        last = len(self.rows)
+        while last and not any(str(value) for value in self.rows[last - 1]):
+            last -= 1
+        return last
+
+    def all_values(self):
+        width = max(map(len, self.rows), default=0)
+        return [[str(value) for value in row] + [''] * (width - len(row)) for row in self.rows]
+
+    def get_all_values(self):
+        return self.read('get_all_values', self.all_values)
+
+    def col_values(self, col):
+        def work():
+            values = [str(row[col - 1]) if len(row) >= col else '' for row in self.rows]
+            while values and values[-1] == '':
+                values.pop()
+            return values
+        return self.read('col_values', work)
+
+    def get(self, a1):
+        def work():
+            first, _, last = a1.split('!')[-1].partition(':')
+            startRow = int(re.sub(r'\D', '', first) or 1)
+            endRow = int(re.sub(r'\D', '', last or first) or len(self.rows))
+            startCol = gspread.utils.a1_to_rowcol(re.sub(r'\d', '', first) + '1')[1]
+            endCol = gspread.utils.a1_to_rowcol(re.sub(r'\d', '', last or first) + '1')[1]
+            values = self.all_values()[startRow - 1:endRow]
+            return [row[startCol - 1:endCol] for row in values]
+        return self.read('get', work)
+
+    def append_rows(self, values, **kwargs):
+        return self.write('append_rows', lambda: {'updates': {'updatedRange': self.set_values(f'A{self.last_row() + 1}', values)}},
+                          idempotent=False)
+
+    def update(self, values, a1, **kwargs):
+        return self.write('update', lambda: {'updatedRange': self.set_values(a1, values)})
+
+    def batch_update(self, data, **kwargs):
+        return self.write('batch_update', lambda: {'responses': [{'updatedRange': self.set_values(d['range'], d['values'])} for d in data]})
+
+
+class FakeSpreadsheet:
+    def __init__(self, google, key, tables=None, rawData=None, validations=None):
+        self.google = google
+        self.id = key
+        self.name = key
+        self.properties = {}
+        self.modified = time.time()
+        self.sheets = [FakeWorksheet(google, key, 'Tables', tables),
+                       FakeWorksheet(google, key, 'RawData', rawData),
+                       FakeWorksheet(google, key, 'Validations', validations)]
+
+    def worksheets(self):
+        self.google.count(self.id)
+        return self.sheets
+
+    def copy(self, key):
+        return FakeSpreadsheet(self.google, key, *[[list(row) for row in sheet.rows] for sheet in self.sheets])
+
+
+class FakeGspreadClient:
+    def __init__(self, google):
+        self.google = google
+        self.http_client = mock.MagicMock()
+        self.http_client.session.hooks = {'response': google.hooks}
+
+    def open_by_key(self, key):
+        return self.google.call(key, 'sheets_read', lambda: self.google.spreadsheets[key], endpoint='open_by_key')
+
+
+class FakeRequest:
+    """A discovery client request, sent by the bot's execute()."""
+    def __init__(self, google, key, uri, method, work):
+        self.google, self.key, self.uri, self.method, self.work = google, key, uri, method, work
+
+    def execute(self):
+        self.google.count(self.key)
+        return self.work()
+
+
+class FakeDrive:
+    """The Drive v3 calls the bot makes: copying the template, sharing and naming it, and file metadata."""
+    uri = 'https://www.googleapis.com/drive/v3/files'
+
+    def __init__(self, google):
+        self.google = google
+
+    def files(self):
+        return self
+
+    def permissions(self):
+        return self
+
+    def copy(self, fileId, body, **kwargs):
+        with self.google.lock:
+            self.google.copies += 1
+            key = f'sheet-{self.google.copies}'
+
+        def work():
+            copied = self.google.spreadsheets[key] = self.google.template.copy(key)
+            copied.name, copied.properties = body.get('name'), body.get('appProperties', {})
+            return {'id': key, 'name': copied.name}
+        # counted on the copy, so each guild's setup counts its own calls
+        return FakeRequest(self.google, key, f'{self.uri}/{fileId}/copy', 'POST', work)
+
+    def create(self, fileId, body, **kwargs):
+        return FakeRequest(self.google, fileId, f'{self.uri}/{fileId}/permissions', 'POST', lambda: {'id': 'anyone'})
+
+    def get(self, fileId, **kwargs):
+        def work():
+            modified = self.google.spreadsheets[fileId].modified
+            return {'id': fileId, 'modifiedTime': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(modified)) + f'.{int(modified * 1000) % 1000:03}Z'}
+        return FakeRequest(self.google, fileId, f'{self.uri}/{fileId}', 'GET', work)
+
+    def update(self, fileId, body, **kwargs):
+        def work():
+            self.google.spreadsheets[fileId].name = body['name']
+            return {'id': fileId, 'name': body['name']}
+        return FakeRequest(self.google, fileId, f'{self.uri}/{fileId}', 'PATCH', work)
+
+    def list(self, q='', **kwargs):
+        # only the appProperties search /setup makes is understood, anything else lists every file
+        wanted = dict(re.findall(r"key='([^']*)' and value='([^']*)'", q))
+
+        def work():
+            return {'files': [{'id': key, 'name': sheet.name} for key, sheet in list(self.google.spreadsheets.items())
+                              if wanted.items() <= sheet.properties.items()]}
+        return FakeRequest(self.google, 'drive', self.uri, 'GET', work)
+
+
+class FakeSheetsService:
+    """The Sheets v4 discovery client, only spreadsheets().get is used."""
+    def __init__(self, google):
+        self.google = google
+
+    def spreadsheets(self):
+        return self
+
+    def get(self, spreadsheetId, **kwargs):
+        def work():
+            sheets = self.google.spreadsheets[spreadsheetId].sheets
+            return {'properties': {'title': spreadsheetId}, 'sheets': [{'properties': {'title': sheet.title}} for sheet in sheets]}
+        return FakeRequest(self.google, spreadsheetId, f'https://sheets.googleapis.com/v4/spreadsheets/{spreadsheetId}', 'GET', work)
+
+
+class FakeDiscord:
+    """Latency and call count of every Discord API call the fake interactions make."""
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def call(self, guildID):
+        self.calls[guildID] += 1
+        await asyncio.sleep(self.latency)
+
+
+class FakeMessage:
+    def __init__(self, discord, guildID):
+        self.discord, self.guildID = discord, guildID
+
+    async def edit(self, **kwargs):
+        await self.discord.call(self.guildID)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def respond(self, kwargs):
+        if self.done:
+            raise RuntimeError('interaction already responded to')
+        self.done = True
+        self.interaction.sent.append(kwargs)
+        await self.interaction.discord.call(self.interaction.guild.id)
+
+    async def send_message(self, content=None, **kwargs):
+        await self.respond(dict(kwargs, content=content))
+
+    async def edit_message(self, **kwargs):
+        await self.respond(kwargs)
+
+    async def defer(self, **kwargs):
+        await self.respond({})
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self.interaction.sent.append(dict(kwargs, content=content))
+        await self.interaction.discord.call(self.interaction.guild.id)
+        return FakeMessage(self.interaction.discord, self.interaction.guild.id)
+
+
+class FakeInteraction:
+    """Enough of discord.Interaction for the command callbacks and buttons."""
+    def __init__(self, discord, guildID, channelID):
+        self.discord = discord
+        self.guild = mock.Mock(id=guildID)
+        self.guild.name = f'guild {guildID}'
+        self.channel = mock.Mock(id=channelID)
+        self.user = mock.Mock(id=guildID * 10)
+        self.sent = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+
+def load_bot(latency=0.0):
+    """Import Main against the fake Google backend, keeping its local files in a scratch directory."""
+    google = FakeGoogle(latency)
+    services = {'drive': FakeDrive(google), 'sheets': FakeSheetsService(google)}
+
+    os.chdir(tempfile.mkdtemp(prefix='podstats-bench-'))
+    import Main
+
+    def fake_gspread():
+        with mock.patch('gspread.authorize', return_value=FakeGspreadClient(google)):
+            return Main.build_gspread()
+
+    # the Google clients are only built when first used, so the fakes go in as their builders
+    Main.google_builders.update(creds=lambda: None, gspread=fake_gspread,
+                                drive=lambda: services['drive'], sheets=lambda: services['sheets'])
+    google.bot = Main
+    Main.fake_google = google
+    return Main
+
+
+def make_names(count, rng):
+    """Commander-like names such as 'Veloran, the keen'."""
+    def word(length):
+        return ''.join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+    names = set()
+    while len(names) < count:
+        names.add(f'{word(rng.randint(4, 9))}, the {word(rng.randint(3, 8))}'.capitalize())
+    return sorted(names)
+
+
+def make_typo(name, rng):
+    letters = list(name.lower())
+    for _ in range(rng.randint(1, 2)):
+        i = rng.randrange(len(letters))
+        typo = rng.choice(['drop', 'swap', 'replace'])
+        if typo == 'drop' and len(letters) > 3:
+            del letters[i]
+        elif typo == 'swap' and i < len(letters) - 1:
+            letters[i], letters[i + 1] = letters[i + 1], letters[i]
+        else:
+            letters[i] = rng.choice(string.ascii_lowercase)
+    return ''.join(letters)
+
+
+def bench_matcher(Main, args):
+    rng = random.Random(4)
+    print(f'{"names":>6} | {"difflib us/query":>16} | {"index us/query":>14} | {"speedup":>7} | {"difflib hits":>12} | {"index hits":>10}')
+    for size in (100, 500, 2000):
+        names = make_names(size, rng)
+        asked = [rng.choice(names) for _ in range(200)]
+        typos = [make_typo(name, rng) for name in asked]
+
+        start = time.perf_counter()
+        difflibFixed = [get_close_matches(typo.capitalize(), names, n=1, cutoff=0.4) for typo in typos]
+        difflibTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = Main.NameIndex(names)
+        buildTime = time.perf_counter() - start
+        start = time.perf_counter()
+        indexFixed = Main.correct_name(typos, index)
+        indexTime = time.perf_counter() - start
+
+        difflibHits = sum(bool(fixed) and fixed[0] == name for fixed, name in zip(difflibFixed, asked))
+        indexHits = sum(fixed == name for fixed, name in zip(indexFixed, asked))
+        print(f'{size:>6} | {difflibTime / len(typos) * 1e6:>16.0f} | {indexTime / len(typos) * 1e6:>14.0f} | '
+              f'{difflibTime / indexTime:>6.0f}x | {difflibHits / len(typos):>12.0%} | {indexHits / len(typos):>10.0%}'
+              f'   (index built in {buildTime * 1000:.0f}ms)')
+
+
+def pod_template(google, rng, players, commanders):
+    """The spreadsheet /setup copies, with a roster already filled in."""
+    validations = [['Commanders', '', '', 'Players']]
+    for i in range(max(len(players), len(commanders))):
+        validations.append([commanders[i] if i < len(commanders) else '', '', '',
+                            players[i] if i < len(players) else ''])
+    rawData = [['Game', 'Player', 'Commander', 'First Out', 'Won', 'First Blood', 'Date']]
+    return FakeSpreadsheet(google, 'template', [[]], rawData, validations)
+
+
+def add_history(spreadsheet, games, rng, players, commanders):
+    """Finished games already in RawData before the bot is asked anything."""
+    rawData = spreadsheet.sheets[1].rows
+    for game in range(1, games + 1):
+        seated = rng.sample(players, 4)
+        out, won, blood = rng.choice(seated), rng.choice(seated), rng.choice(seated)
+        for player in seated:
+            rawData.append([game, player, rng.choice(commanders), int(player == out), int(player == won), int(player == blood), '01/01/2024'])
+
+
+class CommandTimer:
+    """Latency and calls of each command, Google calls counted on the guild's spreadsheet."""
+    def __init__(self, Main, discord):
+        self.Main, self.discord = Main, discord
+        self.latencies = defaultdict(list)
+        self.google = Counter()
+        self.discordCalls = Counter()
+
+    async def run(self, name, guildID, step):
+        sheetID = self.Main.active_sheets.get(str(guildID))
+        googleBefore = self.Main.fake_google.calls[sheetID]
+        discordBefore = self.discord.calls[guildID]
+        start = time.perf_counter()
+        result = await step()
+        self.latencies[name].append(time.perf_counter() - start)
+        sheetID = self.Main.active_sheets.get(str(guildID))
+        self.google[name] += self.Main.fake_google.calls[sheetID] - googleBefore
+        self.discordCalls[name] += self.discord.calls[guildID] - discordBefore
+        return result
+
+
+async def watch_loop(stalls, interval=0.005):
+    """Note every time the event loop wakes up late, which is time something blocked it."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(max(0.0, time.perf_counter() - start - interval))
+
+
+async def play_pod(Main, timer, discord, guildID, games, rng, players, commanders, history):
+    channelID = guildID + 1000
+
+    def interaction():
+        return FakeInteraction(discord, guildID, channelID)
+
+    async def setup():
+        await Main.setup.callback(interaction())
+        # the spreadsheet is made in the background, setup is done once the link is sent
+        await Main.setup_tasks[guildID]
+    await timer.run('setup', guildID, setup)
+    add_history(Main.fake_google.spreadsheets[Main.active_sheets[str(guildID)]], history, rng, players, commanders)
+
+    for _ in range(games):
+        seated = rng.sample(players, 4)
+        options = {}
+        for seat, player in enumerate(seated, start=1):
+            options[f'player{seat}'] = player
+            options[f'commander{seat}'] = rng.choice(commanders)
+        await timer.run('addgame', guildID, lambda: Main.addGame.callback(interaction(), **options))
+
+        async def finish():
+            asked = interaction()
+            await Main.finishGame.callback(asked)
+            buttons = {item.custom_id: item for item in asked.sent[-1]['view'].children}
+            gameID = next(iter(buttons)).split(':')[2]
+            for stat in range(3):
+                button = buttons[f'podstats:finish:{gameID}:{stat}:{rng.randrange(len(seated))}']
+                await button.callback(interaction())
+        await timer.run('finishgame', guildID, finish)
+
+        async def sync():
+            events = [(seq, game, event, payload) for seq, guild, game, event, payload in Main.journal.pending() if guild == guildID]
+            await Main.flush_journal(guildID, Main.active_sheets[str(guildID)], events)
+        await timer.run('sync (background)', guildID, sync)
+
+        await timer.run('tableplayer', guildID, lambda: Main.playerTable.callback(interaction()))
+        await timer.run('tablecommander', guildID, lambda: Main.commanderTable.callback(interaction()))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def bench_commands(Main, args):
+    rng = random.Random(7)
+    Main.fake_google.latency = args.latency
+    discord = FakeDiscord(args.discord_latency)
+    for bucket in Main.google_scheduler.buckets.values():
+        bucket.capacity = bucket.tokens = args.quota
+        bucket.rate = args.quota / 60
+
+    importlib.import_module('pandas')  # the bot imports it in the background once it is ready
+    players = [f'Player{i}' for i in range(12)]
+    commanders = make_names(args.commanders, rng)
+    Main.fake_google.template = pod_template(Main.fake_google, rng, players, commanders)
+    Main.fake_google.spreadsheets['template'] = Main.fake_google.template
+    with mock.patch('builtins.print'):
+        # what the bot's fill_template_pool() would have ready before anyone ran /setup
+        for _ in range(args.template_pool):
+            sheetID = Main.copy_template('Pod Stats (spare)')
+            Main.share_spreadsheet(sheetID)
+            Main.setup_jobs.add_spare(sheetID)
+    Main.fake_google.calls.clear()
+    timer = CommandTimer(Main, discord)
+
+    async def run():
+        stalls = []
+        watcher = asyncio.create_task(watch_loop(stalls))
+        start = time.perf_counter()
+        await asyncio.gather(*(play_pod(Main, timer, discord, guildID, args.games, random.Random(guildID), players, commanders, args.history)
+                               for guildID in range(1, args.guilds + 1)))
+        elapsed = time.perf_counter() - start
+        watcher.cancel()
+        return stalls, elapsed
+
+    with mock.patch('builtins.print'):
+        stalls, elapsed = asyncio.run(run())
+
+    print(f'{args.guilds} guilds x {args.games} games, {args.history} games of history, '
+          f'{args.latency * 1000:.0f}ms Google / {args.discord_latency * 1000:.0f}ms Discord latency, '
+          f'{args.quota} Google requests a minute per kind')
+    print(f'{"command":<18} | {"runs":>5} | {"google/cmd":>10} | {"discord/cmd":>11} | {"p50 ms":>8} | {"p99 ms":>8}')
+    for name, latencies in timer.latencies.items():
+        print(f'{name:<18} | {len(latencies):>5} | {timer.google[name] / len(latencies):>10.1f} | '
+              f'{timer.discordCalls[name] / len(latencies):>11.1f} | {percentile(latencies, 0.5) * 1000:>8.1f} | '
+              f'{percentile(latencies, 0.99) * 1000:>8.1f}')
+    print(f'event loop blocked {sum(stalls) * 1000:.0f}ms in total over {elapsed:.1f}s, '
+          f'longest stall {max(stalls, default=0) * 1000:.1f}ms, p99 stall {percentile(stalls or [0], 0.99) * 1000:.1f}ms')
+
+
+def long_history(Main, args):
+    """RawData rows of a pod's years of games, and each game's players, commanders and winner."""
+    rng = random.Random(5)
+    players = [f'Player{i}' for i in range(args.players)]
+    commanders = make_names(args.commanders, rng)
+    rows = [Main.raw_data_columns]
+    games = []
+    for game in range(1, args.rated_games + 1):
+        seated = rng.sample(players, rng.choice([3, 4, 4, 4, 5]))
+        played = [rng.choice(commanders) for _ in seated]
+        winner = rng.randrange(len(seated))
+        games.append((seated, played, seated[winner]))
+        rows.extend([str(game), player, commander, '0', str(int(seat == winner)), '0', '01/01/2024']
+                    for seat, (player, commander) in enumerate(zip(seated, played)))
+    return rows, games
+
+
+def bench_ratings(Main, args):
+    """Replay the ratings of a pod's whole history, against rating the same games one finish at a time."""
+    rows, games = long_history(Main, args)
+
+    start = time.perf_counter()
+    rated = Main.Ratings.replay(rows, [])
+    replayTime = time.perf_counter() - start
+    print(f'replayed {args.rated_games} games ({len(rows) - 1} rows, {args.players} players, {args.commanders} commanders) '
+          f'in {replayTime:.2f}s')
+
+    start = time.perf_counter()
+    finishes = games[:2000]
+    for seated, played, winner in finishes:
+        Main.ratings.record_game(0, seated, played, winner)
+    finishTime = (time.perf_counter() - start) / len(finishes)
+    print(f'one finish updates its pod in {finishTime * 1e6:.0f}us, '
+          f'{finishTime * args.rated_games:.1f}s if the whole history went through it one game at a time')
+    top = sorted(zip(rated['player'][1], rated['player'][0]), reverse=True)[:3]
+    print('top players: ' + ', '.join(f'{name} {rating:.0f}' for rating, name in top))
+
+
+def bench_matchups(Main, args):
+    """Count a pod's whole history into matchups once, then time the lookups /matchup and /commanderstats make."""
+    rows, games = long_history(Main, args)
+    start = time.perf_counter()
+    counted = Main.Matchups.from_rows(rows)
+    print(f'counted {args.rated_games} games ({len(rows) - 1} rows) in {time.perf_counter() - start:.2f}s')
+
+    start = time.perf_counter()
+    for seated, played, winner in games[:2000]:
+        counted.add_games([Main.finished_seats(seated, played, [None, winner, None])])
+    print(f'one finish adds its game in {(time.perf_counter() - start) / 2000 * 1e6:.0f}us')
+
+    players, commanders = list(counted.totals['player']), list(counted.totals['commander'])
+    lookups = [(players[i % len(players)], players[(i + 1) % len(players)], commanders[i % len(commanders)]) for i in range(1000)]
+    times = []
+    for first, second, commander in lookups:
+        start = time.perf_counter()
+        counted.head_to_head('player', counted.match('player', first), counted.match('player', second))
+        counted.match('commander', commander)
+        counted.seat_table('commander', commander)
+        Main.format_table(counted.opponent_table('commander', commander, 'Against'))
+        times.append(time.perf_counter() - start)
+    times.sort()
+    print(f'a /matchup and /commanderstats lookup takes p50 {percentile(times, 0.5) * 1000:.2f}ms, p99 {percentile(times, 0.99) * 1000:.2f}ms')
+
+
+startup_script = '''
+import asyncio, os, sys, tempfile, time
+from unittest import mock
+from google.auth.credentials import AnonymousCredentials
+
+os.chdir(tempfile.mkdtemp(prefix='podstats-startup-'))
+os.environ['MetricsPort'] = '0'
+sys.path.insert(0, sys.argv[1])
+timings = []
+start = time.perf_counter()
+import Main
+timings.append(('import Main', time.perf_counter() - start))
+
+Main.google_builders['creds'] = AnonymousCredentials
+for name in ('gspread', 'drive', 'sheets'):
+    start = time.perf_counter()
+    Main.google_client(name)
+    timings.append((f'first use of the {name} client', time.perf_counter() - start))
+
+async def ready(syncs):
+    start = time.perf_counter()
+    await Main.on_ready()
+    timings.append((f'on_ready ({syncs.await_count} command sync)', time.perf_counter() - start))
+
+async def sync():
+    await asyncio.sleep(float(sys.argv[2]))
+
+async def connect():
+    syncs = mock.AsyncMock(side_effect=sync)
+    with mock.patch.object(Main.tree, 'sync', syncs), mock.patch('builtins.print'):
+        await ready(syncs)
+        syncs.reset_mock()
+        await ready(syncs)
+asyncio.run(connect())
+for name, seconds in timings:
+    print(f'{name:<32} {seconds * 1000:>8.1f}ms')
+'''
+
+
+def bench_startup(Main, args):
+    """Cold start in a fresh interpreter: importing Main, building each Google client, then connecting and reconnecting."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    for run in range(3):
+        print(f'run {run + 1}, a command sync taking {args.discord_latency * 1000:.0f}ms')
+        print(subprocess.run([sys.executable, '-c', startup_script, here, str(args.discord_latency)],
+                             capture_output=True, text=True, check=True).stdout)
+
+
+benchmarks = {
+    'matcher': bench_matcher,
+    'commands': bench_commands,
+    'startup': bench_startup,
+    'ratings': bench_ratings,
+    'matchups': bench_matchups,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmarks', nargs='*', choices=[[]] + list(benchmarks), default=list(benchmarks))
+    parser.add_argument('--guilds', type=int, default=20, help='pods playing at the same time')
+    parser.add_argument('--games', type=int, default=3, help='games each pod plays')
+    parser.add_argument('--history', type=int, default=200, help='games already in each RawData sheet')
+    parser.add_argument('--commanders', type=int, default=300, help='commanders in each roster')
+    parser.add_argument('--template-pool', type=int, default=0, help='spare template copies made before the commands benchmark starts')
+    parser.add_argument('--players', type=int, default=12, help='players in the pod whose history the ratings and matchups benchmarks use')
+    parser.add_argument('--rated-games', type=int, default=100000, help='games of history the ratings and matchups benchmarks use')
+    parser.add_argument('--latency', type=float, default=0.08, help='seconds each Google call takes')
+    parser.add_argument('--discord-latency', type=float, default=0.03, help='seconds each Discord call takes')
+    parser.add_argument('--quota', type=int, default=100000, help='Google requests a minute allowed per kind')
+    args = parser.parse_args()
+
+    bot = load_bot()
+    for name in args.benchmarks:
+        print(f'== {name} ==')
+        benchmarks[name](bot, args)
@@ -0,0 +1,72 @@
+"""Drawing the bot's charts, run as its own process so rendering never imports the bot.
+
+Main.py starts this file with the same Python and sends it (chart, series) pickles, each
+prefixed with its length, on stdin. Every request is answered the same way on stdout
+with (True, PNG bytes), or (False, the exception) when drawing failed.
+"""
+import io
+import pickle
+import sys
+
+
+def render_chart(chart, series):
+    """PNG bytes of a chart drawn with headless matplotlib, series being what chart_series() gave for it."""
+    import matplotlib  # only the render processes need matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8, 4.5), dpi=100)
+    axes = figure.add_subplot()
+    chart_drawings[chart](axes, series)
+    figure.tight_layout()
+    image = io.BytesIO()
+    figure.savefig(image, format='png')
+    return image.getvalue()
+
+def draw_win_rate(axes, series):
+    """A line per player of their win rate so far, by how many games the pod had played."""
+    from matplotlib.ticker import PercentFormatter
+
+    for player, (games, rates) in series.items():
+        axes.plot(games, rates, label=player)
+    axes.set_title('Win rate over time')
+    axes.set_xlabel('Game')
+    axes.set_ylabel('Win rate')
+    axes.yaxis.set_major_formatter(PercentFormatter(1.0))
+    if series:
+        axes.legend(fontsize='small', loc='upper left', bbox_to_anchor=(1, 1))
+
+def draw_popularity(axes, series):
+    """A line per commander of how many games it was played in each month."""
+    months, counts = series
+    for commander, games in counts.items():
+        axes.plot(range(len(months)), games, marker='o', markersize=3, label=commander)
+    # about a dozen month labels however long the history is
+    step = max(1, len(months) // 12)
+    axes.set_xticks(range(0, len(months), step), months[::step], rotation=45, ha='right')
+    axes.set_title('Commander popularity')
+    axes.set_ylabel('Games per month')
+    if counts:
+        axes.legend(fontsize='small', loc='upper left', bbox_to_anchor=(1, 1))
+
+chart_drawings = {'winrate': draw_win_rate, 'popularity': draw_popularity}
+
+def frame(data):
+    return len(data).to_bytes(8, 'big') + data
+
+def serve(requests, answers):
+    """Draw every chart asked for on requests until it closes, answering each on answers."""
+    while True:
+        size = requests.read(8)
+        if len(size) < 8:
+            return
+        chart, series = pickle.loads(requests.read(int.from_bytes(size, 'big')))
+        try:
+            answer = (True, render_chart(chart, series))
+        except Exception as error:
+            answer = (False, error)
+        answers.write(frame(pickle.dumps(answer)))
+        answers.flush()
+
+if __name__ == '__main__':
+    serve(sys.stdin.buffer, sys.stdout.buffer)